@@ -1,74 +1,197 @@
 import os
-from enum import Enum
 from typing import List
 from services.lens_service import (
-    SearchType, ResultType, get_app_ids, get_publication_comments, get_trends, index_contents,
-    MetadataSchema, search_nfts, search_profiles, search_publications
+    SearchType, ResultType, ResponseView, TrendsWindow, InvalidCursorError, MultiSearchEndpoint, MultiSearchSchema, async_multi_search, async_get_app_ids, async_get_publication_comments, async_get_trends, index_contents,
+    MetadataSchema, SOURCE_FIELDS_PATTERN, SOURCE_FIELDS_MAX_LENGTH, async_export_publication_comments, async_export_publications, async_search_nfts, async_search_profiles,
+    async_search_publications, uses_point_in_time
 )
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 import logging
-from services.es_search import es
+import orjson
+from services.es_search import es, async_es
+from services.graph_service import DirectionEnum, TRAVERSE_MAX_VERTICES, async_get_traversal
+from services.ingest import IngestLineTooLong, IngestPipeline, IngestQueueFull, iter_ndjson_lines
+from services.metrics import get_metrics, incr
+from services.suggest import SuggestionKind, async_ensure_suggest_index, async_suggest
+from services.timing import get_server_timing, get_spans, record_spans, reset_spans, start_spans
+from services.trends import TRENDS_MATERIALIZER_ENABLED, TrendsMaterializer, read_trends
 from datetime import date
 import time
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
 from fastapi.params import Query
+from pydantic import ValidationError
 import aioredis
+from elasticsearch import ElasticsearchException
 import traceback
 from arango import ArangoClient
+from app.cache import CachedJSONResponse, ORJSONCoder, cache, get_canonical_kwargs, get_many_or_load, search_key_builder
 from app.custom_http_client import CustomHTTPClient
 
 
 logger = logging.getLogger(__name__)
 
 INDEXING_LIMIT = 100
+# adds the request's spans as a Server-Timing header, off by default since it exposes backend timings to clients
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+# requests slower than this are logged at INFO, faster ones at DEBUG, all of them are in the histograms
+REQUEST_TIMING_LOG_MIN_MS = float(os.environ.get('REQUEST_TIMING_LOG_MIN_MS', 500))
 
 GRAPHDB_PASSWORD = os.environ.get('GRAPHDB_PASSWORD')
 GRAPHDB_HOST = os.environ.get('GRAPHDB_HOST')
 
-class DirectionEnum(str, Enum):
-    any = "any"
-    inbound = "inbound"
-    outbound = "outbound"
+async def iter_ndjson(documents):
+    async for document in documents:
+        yield orjson.dumps(document) + b"\n"
+
+
+def is_point_in_time_search(params: dict):
+    # a point in time is closed once one client reads its last page, so its cursors can't be shared through the cache
+    return uses_point_in_time(params.get("cursor"), params.get("consistent", False))
 
 
 def get_application() -> FastAPI:
-    application = FastAPI(title="Lens Service", debug=True, version="1.0")
+    application = FastAPI(title="Lens Service", debug=True, version="1.0", default_response_class=ORJSONResponse)
     client = ArangoClient(
         hosts=GRAPHDB_HOST, http_client=CustomHTTPClient())
     graph_db = client.db("lens", username="root", password=GRAPHDB_PASSWORD)
+    ingest_pipeline = IngestPipeline(async_es)
+    trends_materializer = TrendsMaterializer()
 
     @application.on_event("startup")
     async def startup_event():
         es.init_app()
+        async_es.init_app()
         redis = await aioredis.create_redis_pool(f"redis://:{os.environ.get('REDIS_PASSWORD')}@{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT','6379')}/0", encoding="utf8")
-        FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+        FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache", coder=ORJSONCoder)
+        application.state.redis = redis
+        try:
+            await async_ensure_suggest_index()
+        except ElasticsearchException:
+            # typeahead is optional, an unreachable or forbidden ES must not keep the search endpoints from serving
+            logger.warning("Could not ensure the suggest index, /suggest fails until it exists", exc_info=True)
+        await ingest_pipeline.start()
+        if TRENDS_MATERIALIZER_ENABLED:
+            trends_materializer.start(redis)
+
+    @application.on_event("shutdown")
+    async def shutdown_event():
+        await trends_materializer.stop()
+        await ingest_pipeline.stop()
+        await async_es.close()
+
+    @application.middleware("http")
+    async def timing_middleware(request: Request, call_next):
+        token = start_spans()
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            spans = get_spans()
+            reset_spans(token)
+        seconds = time.perf_counter() - started
+        # the router puts the matched endpoint in the shared scope, route names keep the label set bounded
+        endpoint = getattr(request.scope.get("endpoint"), "__name__", "unmatched")
+        record_spans(endpoint, spans, seconds)
+        level = logging.INFO if seconds * 1000 >= REQUEST_TIMING_LOG_MIN_MS else logging.DEBUG
+        if logger.isEnabledFor(level):
+            # method, path and query make these records a query log for benchmarks.replay, a full one at DEBUG
+            logger.log(level, "request timing", extra={"endpoint": endpoint, "method": request.method, "path": request.url.path,
+                                                       "query": request.url.query, "status": response.status_code,
+                                                       "duration_ms": round(seconds * 1000, 3), "spans": spans})
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = get_server_timing(spans, seconds)
+        return response
+
+    @application.exception_handler(InvalidCursorError)
+    async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
 
     @application.get("/publications")
-    @cache(expire=10)
+    @cache(expire=10, key_builder=search_key_builder, bypass=is_point_in_time_search)
     async def search_publications_endpoint(text: str = "", bio: str = None, from_users: str = None, mention_users: str = None,
                                            search_type: SearchType = SearchType.any_words, result_type: ResultType = ResultType.top,
                                            min_collects: int = None, min_mirror: int = None, min_comments: int = None,
                                            min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None,
-                                           from_date: date = None, to_date: date = None, page: int = 1, size: int = 10):
-        return search_publications(text, bio, from_users, mention_users, search_type, result_type, min_collects, min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id, from_date, to_date, page, size)
+                                           from_date: date = None, to_date: date = None, page: int = 1, size: int = 10,
+                                           cursor: str = None, consistent: bool = False, view: ResponseView = ResponseView.full,
+                                           fields: str = Query(None, regex=SOURCE_FIELDS_PATTERN, max_length=SOURCE_FIELDS_MAX_LENGTH,
+                                                               description="comma separated _source fields, overrides view")):
+        return await async_search_publications(text, bio, from_users, mention_users, search_type, result_type, min_collects, min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id, from_date, to_date, page, size, cursor, consistent, view, fields)
     
+    # exports are streamed page by page and never cached, their size would only push search pages out of the cache
+    @application.get("/publications/export")
+    async def export_publications_endpoint(text: str = "", bio: str = None, from_users: str = None, mention_users: str = None,
+                                           search_type: SearchType = SearchType.any_words, result_type: ResultType = ResultType.latest,
+                                           min_collects: int = None, min_mirror: int = None, min_comments: int = None,
+                                           min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None,
+                                           from_date: date = None, to_date: date = None, view: ResponseView = ResponseView.full,
+                                           fields: str = Query(None, regex=SOURCE_FIELDS_PATTERN, max_length=SOURCE_FIELDS_MAX_LENGTH,
+                                                               description="comma separated _source fields, overrides view")):
+        documents = async_export_publications(text, bio, from_users, mention_users, search_type, result_type, min_collects, min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id, from_date, to_date, view, fields)
+        return StreamingResponse(iter_ndjson(documents), media_type="application/x-ndjson")
+
+    @application.get("/comments/export")
+    async def export_publication_comments_endpoint(pub_id: str, view: ResponseView = ResponseView.full,
+                                                   fields: str = Query(None, regex=SOURCE_FIELDS_PATTERN, max_length=SOURCE_FIELDS_MAX_LENGTH,
+                                                                       description="comma separated _source fields, overrides view")):
+        return StreamingResponse(iter_ndjson(async_export_publication_comments(pub_id, view, fields)), media_type="application/x-ndjson")
+
     @application.get("/comments")
-    @cache(expire=10)
-    async def get_publication_comments_endpoint(pub_id:str, page: int = 1, size: int = 10):
-        return get_publication_comments(pub_id, page, size)
+    @cache(expire=10, key_builder=search_key_builder, bypass=is_point_in_time_search)
+    async def get_publication_comments_endpoint(pub_id:str, page: int = 1, size: int = 10, cursor: str = None, consistent: bool = False,
+                                                view: ResponseView = ResponseView.full,
+                                                fields: str = Query(None, regex=SOURCE_FIELDS_PATTERN, max_length=SOURCE_FIELDS_MAX_LENGTH,
+                                                                    description="comma separated _source fields, overrides view")):
+        return await async_get_publication_comments(pub_id, page, size, cursor, consistent, view, fields)
 
     @application.get("/profiles")
-    @cache(expire=10)
+    @cache(expire=10, key_builder=search_key_builder)
     async def search_profiles_endpoint(text: str = "", bio: str = None, page: int = 1, size: int = 10, owned_by: str = None,
                                        min_follower: int = None, min_posts: int = None, min_publications: int = None, min_comments: int = None):
-        return search_profiles(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments, page, size)
+        return await async_search_profiles(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments, page, size)
 
     @application.get("/nfts")
-    @cache(expire=10)
+    @cache(expire=10, key_builder=search_key_builder)
     async def search_nfts_endpoint(text: str = "", page: int = 1, size: int = 10, search_type: SearchType = SearchType.all_words,):
-        return search_nfts(text, search_type, page, size)
+        return await async_search_nfts(text, search_type, page, size)
+
+    @application.get("/suggest")
+    @cache(expire=60, key_builder=search_key_builder)
+    async def suggest_endpoint(prefix: str = Query(..., min_length=1, max_length=64),
+                               kind: List[SuggestionKind] = Query(None), size: int = 8):
+        return await async_suggest(prefix, kind, size)
+
+    multi_search_endpoints = {
+        MultiSearchEndpoint.publications: search_publications_endpoint,
+        MultiSearchEndpoint.profiles: search_profiles_endpoint,
+        MultiSearchEndpoint.nfts: search_nfts_endpoint,
+    }
+
+    @application.post("/search/multi")
+    async def multi_search_endpoint(request: MultiSearchSchema):
+        queries = [(MultiSearchEndpoint(query.type), query.dict(exclude={"type"})) for query in request.queries]
+        # point in time sub-queries skip the cache like their single endpoint does
+        pit_indices = [i for i, (_, params) in enumerate(queries) if is_point_in_time_search(params)]
+        cached_indices = [i for i in range(len(queries)) if i not in pit_indices]
+        results = [None] * len(queries)
+        coder = FastAPICache.get_coder()
+        if cached_indices:
+            # same keys as the single endpoints, so /search/multi and /publications etc. share cache entries
+            cache_keys = [search_key_builder(multi_search_endpoints[queries[i][0]], args=(), kwargs=queries[i][1]) for i in cached_indices]
+
+            async def load_many(indices):
+                return await async_multi_search([(queries[cached_indices[i]][0], get_canonical_kwargs(queries[cached_indices[i]][1]))
+                                                 for i in indices])
+
+            for i, value in zip(cached_indices, await get_many_or_load(cache_keys, load_many, 10, coder, "multi_search")):
+                results[i] = value
+        if pit_indices:
+            for i, value in zip(pit_indices, await async_multi_search([queries[i] for i in pit_indices])):
+                results[i] = coder.encode(value)
+        # cached sub-results are already encoded bodies, splice them instead of decoding
+        return CachedJSONResponse(b'{"results":[' + b",".join(results) + b"]}")
 
     @application.post("/index", status_code=status.HTTP_201_CREATED)
     def index_lens_contents(contents: List[MetadataSchema]):
@@ -90,24 +213,68 @@ def get_application() -> FastAPI:
                 detail=f"Indexing error at our end. Error '{error}'"
             )
 
+    @application.post("/index/batch", status_code=status.HTTP_202_ACCEPTED)
+    async def index_lens_contents_batch(request: Request):
+        batch = ingest_pipeline.create_batch()
+        position = 0
+        try:
+            async for line in iter_ndjson_lines(request.stream()):
+                try:
+                    content = MetadataSchema.parse_raw(line)
+                except ValidationError as e:
+                    batch.accepted += 1
+                    batch.add_error(position, e.errors())
+                else:
+                    await ingest_pipeline.put(batch, content.dict())
+                position += 1
+        except IngestQueueFull as e:
+            # documents accepted so far are still indexed, clients resend from position `accepted`
+            return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"},
+                                content={"detail": str(e), **batch.dict()})
+        except IngestLineTooLong as e:
+            # the rest of the body is not read, documents before the oversized one are still indexed
+            return JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                content={"detail": f"{str(e)} at position {position}", **batch.dict()})
+        finally:
+            batch.closed = True
+        return batch.dict()
+
+    @application.get("/index/batch/{batch_id}")
+    async def get_index_batch(batch_id: str):
+        batch = ingest_pipeline.get_batch(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Batch '{batch_id}' not found")
+        return batch.dict()
+
     @application.get("/trends", status_code=status.HTTP_200_OK)
-    @cache(expire=600)
-    async def get_trends_api(size: int = 20):
-        return get_trends(size, days_back=2)
+    @cache(expire=600, key_builder=search_key_builder)
+    async def get_trends_api(size: int = 20, window: TrendsWindow = TrendsWindow.two_days, app_id: str = None):
+        trends = await read_trends(application.state.redis, window, app_id, size)
+        if trends is None:
+            incr("trends_fallback_total", window=window.value)
+            trends = await async_get_trends(size, app_id=app_id, window=window)
+        return trends
 
     @application.get("/app_id/all")
     @cache(expire=600)
     async def get_app_ids_endpoint(size: int = 20):
-        return get_app_ids(size)
+        return await async_get_app_ids(size)
     
 
+    @application.get("/metrics")
+    async def get_metrics_endpoint():
+        return get_metrics()
+
     @application.get("/traverse")
-    async def traverse(start: str = Query("start node id"),
+    @cache(expire=300, key_builder=search_key_builder)
+    async def traverse(start: str = Query(..., description="start node id"),
                  max_depth: int = Query(2, description="max depth"),
-                 direction: DirectionEnum = Query("any")):
-        try:
-            return graph_db.graph("profiles-graph").traverse(start_vertex=f"profiles/{start}", direction="any", max_depth=max_depth)
-        except:
-            return {"message": f"Data for {start} not found!"}
+                 direction: DirectionEnum = Query(DirectionEnum.any),
+                 limit: int = Query(TRAVERSE_MAX_VERTICES, description="max vertices returned")):
+        traversal = await async_get_traversal(graph_db, start, max_depth, direction, limit)
+        if traversal is None:
+            # not cached, the profile may be ingested any moment
+            return JSONResponse({"message": f"Data for {start} not found!"})
+        return traversal
 
     return application
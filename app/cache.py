@@ -0,0 +1,325 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from enum import Enum
+from functools import wraps
+from typing import Any, Callable, List, Optional, Type
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache import FastAPICache
+from fastapi_cache.coder import Coder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from services import metrics
+from services.timing import span
+
+L1_CACHE_MAX_ENTRIES = int(os.environ.get('L1_CACHE_MAX_ENTRIES', 2000))
+L1_CACHE_MAX_BYTES = int(os.environ.get('L1_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_REQUEST_PARAM = "cache_request"
+
+# free-text params that only reach analyzed match queries or the lowercasing suggest analyzer, so case never changes the ES result
+CASE_INSENSITIVE_PARAMS = {"text", "bio", "mention_users", "prefix"}
+
+
+class ORJSONCoder(Coder):
+    """Caches the response body: encoded once with orjson, and decoded back to the same bytes without parsing."""
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        return orjson.dumps(value, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+
+    @classmethod
+    def decode(cls, value: Any) -> bytes:
+        # the redis pool is opened with encoding="utf8", so hits come back as str
+        return value.encode() if isinstance(value, str) else value
+
+
+class CachedJSONResponse(Response):
+    media_type = "application/json"
+
+
+class LocalCache:
+    """Per-worker LRU cache with per-entry TTL, bounded by entry count and encoded size."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self.remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, expire: int, size: int):
+        if size > self.max_bytes:
+            return
+        self.remove(key)
+        self._entries[key] = (time.monotonic() + expire, value, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            metrics.incr("cache_evictions_total", tier="l1")
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+local_cache = LocalCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES)
+_inflight = {}
+
+
+async def get_or_load(cache_key: str, load: Callable, expire: int, coder: Type[Coder], endpoint: str):
+    with span("cache_l1") as fields:
+        value = local_cache.get(cache_key)
+        fields["hit"] = value is not None
+    if value is not None:
+        metrics.incr("cache_hits_total", tier="l1", endpoint=endpoint)
+        return value
+    metrics.incr("cache_misses_total", tier="l1", endpoint=endpoint)
+
+    # single flight: concurrent misses on one key share one lookup, run detached so that a caller going away
+    # cancels neither the load nor the other callers waiting on it
+    task = _inflight.get(cache_key)
+    if task is not None:
+        metrics.incr("cache_coalesced_total", tier="l1", endpoint=endpoint)
+    else:
+        task = _inflight[cache_key] = asyncio.ensure_future(load_from_backend(cache_key, load, expire, coder, endpoint))
+        task.add_done_callback(lambda done: forget_inflight(cache_key, done))
+    return await asyncio.shield(task)
+
+
+def forget_inflight(cache_key: str, task: asyncio.Future):
+    _inflight.pop(cache_key, None)
+    retrieve_exception(task)
+
+
+def retrieve_exception(task: asyncio.Future):
+    # marks a failure as retrieved when every caller went away before it finished
+    if not task.cancelled():
+        task.exception()
+
+
+async def load_from_backend(cache_key: str, load: Callable, expire: int, coder: Type[Coder], endpoint: str):
+    backend = FastAPICache.get_backend()
+    with span("cache_l2") as fields:
+        ttl, ret = await backend.get_with_ttl(cache_key)
+        fields["hit"] = ret is not None
+    if ret is not None:
+        metrics.incr("cache_hits_total", tier="l2", endpoint=endpoint)
+        value = coder.decode(ret)
+        local_cache.set(cache_key, value, ttl if ttl and ttl > 0 else expire, len(ret))
+        return value
+    metrics.incr("cache_misses_total", tier="l2", endpoint=endpoint)
+
+    value = await load()
+    # a Response is served as is and never stored, endpoints return one for results not worth caching
+    if isinstance(value, Response):
+        return value
+    with span("serialize"):
+        encoded = coder.encode(value)
+    # misses answer with what a hit would return, so both tiers and the response share one encoding
+    value = coder.decode(encoded)
+    with span("cache_store"):
+        await backend.set(cache_key, encoded, expire)
+    local_cache.set(cache_key, value, expire, len(encoded))
+    return value
+
+
+async def get_many_or_load(cache_keys: List[str], load_many: Callable, expire: int, coder: Type[Coder], endpoint: str):
+    """Batch variant of get_or_load: keys missing from both tiers are loaded together by one ``load_many(indices)``."""
+    with span("cache_l1"):
+        values = [local_cache.get(key) for key in cache_keys]
+    loop = asyncio.get_running_loop()
+    waiting = {}
+    futures = {}
+    for i, key in enumerate(cache_keys):
+        if values[i] is not None:
+            metrics.incr("cache_hits_total", tier="l1", endpoint=endpoint)
+            continue
+        metrics.incr("cache_misses_total", tier="l1", endpoint=endpoint)
+        if key in _inflight:
+            # loaded by a concurrent request, or repeated within this batch
+            metrics.incr("cache_coalesced_total", tier="l1", endpoint=endpoint)
+            waiting[i] = _inflight[key]
+        else:
+            futures[i] = _inflight[key] = loop.create_future()
+
+    if futures:
+        task = asyncio.ensure_future(load_many_from_backend(cache_keys, futures, load_many, expire, coder, endpoint))
+        task.add_done_callback(retrieve_exception)
+        for i, value in (await asyncio.shield(task)).items():
+            values[i] = value
+
+    for i, future in waiting.items():
+        values[i] = await asyncio.shield(future)
+    return values
+
+
+async def load_many_from_backend(cache_keys: List[str], futures: dict, load_many: Callable, expire: int, coder: Type[Coder],
+                                 endpoint: str):
+    """Loads the keys of ``futures`` from the backend, or else ``load_many``, resolving each future. Returns the values by index."""
+    values = {}
+    try:
+        backend = FastAPICache.get_backend()
+        with span("cache_l2"):
+            cached = await asyncio.gather(*[backend.get_with_ttl(cache_keys[i]) for i in futures])
+        to_load = []
+        for i, (ttl, ret) in zip(futures, cached):
+            if ret is None:
+                metrics.incr("cache_misses_total", tier="l2", endpoint=endpoint)
+                to_load.append(i)
+                continue
+            metrics.incr("cache_hits_total", tier="l2", endpoint=endpoint)
+            values[i] = coder.decode(ret)
+            local_cache.set(cache_keys[i], values[i], ttl if ttl and ttl > 0 else expire, len(ret))
+            futures[i].set_result(values[i])
+        if to_load:
+            loaded = await load_many(to_load)
+            with span("serialize"):
+                encoded = [coder.encode(value) for value in loaded]
+            for i, ret in zip(to_load, encoded):
+                values[i] = coder.decode(ret)
+                local_cache.set(cache_keys[i], values[i], expire, len(ret))
+                futures[i].set_result(values[i])
+            with span("cache_store"):
+                await asyncio.gather(*[backend.set(cache_keys[i], ret, expire) for i, ret in zip(to_load, encoded)])
+    except BaseException as e:
+        for future in futures.values():
+            if future.done():
+                continue
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+        raise
+    finally:
+        for i in futures:
+            _inflight.pop(cache_keys[i], None)
+    return values
+
+
+def get_canonical_param(name: str, value):
+    if isinstance(value, list):
+        # repeated query params are filters, their order never changes the ES result
+        return sorted({get_canonical_param(name, item) for item in value})
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, date):
+        value = value.isoformat()
+    if isinstance(value, str):
+        value = value.strip()
+        if name in CASE_INSENSITIVE_PARAMS:
+            value = value.casefold()
+    if name == "page":
+        value = max(value, 1)
+    if name == "fields":
+        value = ",".join(sorted({field.strip() for field in value.split(",") if field.strip()}))
+    return value
+
+
+def get_canonical_params(kwargs: dict):
+    """Returns the params that affect the ES body, and whether any provided value had to be rewritten."""
+    params = {}
+    rewritten = False
+    for name, value in kwargs.items():
+        if value is None:
+            continue
+        canonical = get_canonical_param(name, value)
+        # add_match_query and add_range_query skip these, so they are the same as not passing them
+        dropped = canonical == "" or (name.startswith("min_") and canonical <= 0)
+        if dropped:
+            rewritten = rewritten or value != ""
+            continue
+        params[name] = canonical
+        if isinstance(value, Enum):
+            value = value.value
+        if isinstance(value, date):
+            value = value.isoformat()
+        rewritten = rewritten or canonical != value
+    return dict(sorted(params.items())), rewritten
+
+
+def get_canonical_kwargs(kwargs: dict):
+    """Returns the endpoint kwargs with normalized values in their canonical form, so a cached body, query echo
+    included, is the same whichever of the equivalent requests loaded it."""
+    canonical_kwargs = dict(kwargs)
+    for name, value in kwargs.items():
+        # enums and dates only differ in how the key spells them, lists reach the endpoint as given
+        if value is None or isinstance(value, (Enum, date, list, bool)):
+            continue
+        canonical = get_canonical_param(name, value)
+        canonical_kwargs[name] = None if name.startswith("min_") and canonical <= 0 else canonical
+    return canonical_kwargs
+
+
+def search_key_builder(
+    func,
+    namespace: Optional[str] = "",
+    request=None,
+    response=None,
+    args: Optional[tuple] = None,
+    kwargs: Optional[dict] = None,
+):
+    """Key builder for the search endpoints: requests that build the same ES body share one cache entry."""
+    params, rewritten = get_canonical_params(kwargs or {})
+    if rewritten:
+        metrics.incr("cache_key_normalized_total", endpoint=func.__name__)
+    return f"{FastAPICache.get_prefix()}:{namespace}:{func.__module__}:{func.__name__}:{args}:{params}"
+
+
+def cache(
+    expire: int = None,
+    coder: Type[Coder] = None,
+    key_builder: Callable = None,
+    namespace: Optional[str] = "",
+    bypass: Callable[[dict], bool] = None,
+):
+    """Drop-in for fastapi_cache's ``cache`` that puts the per-worker L1 tier in front of the configured backend.
+
+    Calls for which ``bypass(kwargs)`` is true, and requests sent with ``Cache-Control: no-store``, go straight to the
+    endpoint, neither read from nor written to the cache."""
+
+    def wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            request = kwargs.pop(CACHE_REQUEST_PARAM, None)
+            if (bypass and bypass(kwargs)) or (request and "no-store" in request.headers.get("Cache-Control", "")):
+                metrics.incr("cache_bypass_total", endpoint=func.__name__)
+                return await func(*args, **kwargs)
+            cache_key = (key_builder or FastAPICache.get_key_builder())(
+                func, namespace, request=None, response=None, args=args, kwargs=kwargs
+            )
+            load_kwargs = get_canonical_kwargs(kwargs) if key_builder is search_key_builder else kwargs
+            value = await get_or_load(
+                cache_key, lambda: func(*args, **load_kwargs), expire or FastAPICache.get_expire(),
+                coder or FastAPICache.get_coder(), func.__name__
+            )
+            # an encoded body is served as is, returning a Response skips FastAPI's jsonable_encoder and json.dumps
+            return CachedJSONResponse(value) if isinstance(value, bytes) else value
+
+        # FastAPI hands the endpoint its request through an extra keyword-only param the endpoint itself never sees
+        signature = inspect.signature(func)
+        inner.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter(CACHE_REQUEST_PARAM, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        ])
+        return inner
+
+    return wrapper
@@ -1,28 +1,77 @@
 import logging
+import os
+import threading
 
 from requests.adapters import HTTPAdapter
 from requests import Session
 from arango.response import Response
 import urllib3
+from urllib3.util.retry import Retry
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 from arango.http import HTTPClient
 
+from services import metrics
+
+# connections kept per host, size this to the worker's concurrent /traverse calls
+ARANGO_POOL_MAXSIZE = int(os.environ.get('ARANGO_POOL_MAXSIZE', 32))
+ARANGO_POOL_CONNECTIONS = int(os.environ.get('ARANGO_POOL_CONNECTIONS', 4))
+# wait for a pooled connection instead of opening throwaway ones past ARANGO_POOL_MAXSIZE
+ARANGO_POOL_BLOCK = os.environ.get('ARANGO_POOL_BLOCK', 'true').lower() == 'true'
+ARANGO_RETRIES = int(os.environ.get('ARANGO_RETRIES', 3))
+ARANGO_BACKOFF_FACTOR = float(os.environ.get('ARANGO_BACKOFF_FACTOR', 0.3))
+ARANGO_CONNECT_TIMEOUT = float(os.environ.get('ARANGO_CONNECT_TIMEOUT', 3))
+ARANGO_READ_TIMEOUT = float(os.environ.get('ARANGO_READ_TIMEOUT', 10))
+# "true", "false" or a CA bundle path
+ARANGO_VERIFY = os.environ.get('ARANGO_VERIFY', 'false')
+
 
 class CustomHTTPClient(HTTPClient):
 
     def __init__(self):
         self._logger = logging.getLogger('my_logger')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._adapters = []
+        self.verify = {'true': True, 'false': False}.get(ARANGO_VERIFY.lower(), ARANGO_VERIFY)
+        self.timeout = (ARANGO_CONNECT_TIMEOUT, ARANGO_READ_TIMEOUT)
 
     def create_session(self, host):
         session = Session()
         session.headers.update({'x-my-header': 'true'})
-        http_adapter = HTTPAdapter()
+        # connection errors are retried for every method, statuses only for idempotent ones since AQL cursors are POSTs
+        retry = Retry(
+            total=ARANGO_RETRIES,
+            backoff_factor=ARANGO_BACKOFF_FACTOR,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=["HEAD", "GET", "OPTIONS"],
+            raise_on_status=False,
+        )
+        http_adapter = HTTPAdapter(pool_connections=ARANGO_POOL_CONNECTIONS, pool_maxsize=ARANGO_POOL_MAXSIZE,
+                                   pool_block=ARANGO_POOL_BLOCK, max_retries=retry)
         session.mount('https://', http_adapter)
         session.mount('http://', http_adapter)
+        self._adapters.append(http_adapter)
+        metrics.set_gauge("arango_pool_maxsize", ARANGO_POOL_MAXSIZE)
 
         return session
 
+    def update_pool_metrics(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            metrics.set_gauge("arango_requests_in_flight", self._in_flight)
+            in_use = idle = 0
+            for adapter in self._adapters:
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None or pool.pool is None:
+                        continue
+                    # the queue starts with maxsize placeholders, each checked out connection leaves one slot empty
+                    in_use += pool.pool.maxsize - pool.pool.qsize()
+                    idle += sum(conn is not None for conn in list(pool.pool.queue))
+            metrics.set_gauge("arango_pool_connections", in_use, state="in_use")
+            metrics.set_gauge("arango_pool_connections", idle, state="idle")
+
     def send_request(self,
                      session,
                      method,
@@ -33,16 +82,20 @@ class CustomHTTPClient(HTTPClient):
                      auth=None):
         self._logger.debug(f'Sending request to {url}')
 
-        response = session.request(
-            method=method,
-            url=url,
-            params=params,
-            data=data,
-            headers=headers,
-            auth=auth,
-            verify=False, 
-            timeout=10 
-        )
+        self.update_pool_metrics(1)
+        try:
+            response = session.request(
+                method=method,
+                url=url,
+                params=params,
+                data=data,
+                headers=headers,
+                auth=auth,
+                verify=self.verify,
+                timeout=self.timeout
+            )
+        finally:
+            self.update_pool_metrics(-1)
         self._logger.debug(f'Got {response.status_code}')
 
         return Response(
@@ -52,4 +105,4 @@ class CustomHTTPClient(HTTPClient):
             status_code=response.status_code,
             status_text=response.reason,
             raw_body=response.text,
-        )
\ No newline at end of file
+        )
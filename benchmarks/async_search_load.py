@@ -0,0 +1,66 @@
+"""Compare event-loop latency of the sync and async search paths under rising concurrency.
+
+    python -m benchmarks.async_search_load --latency 0.05 --requests 256
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.stub_es import StubElasticsearch
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def run_level(handler, concurrency: int, total: int):
+    latencies = []
+
+    async def timed(started):
+        await handler()
+        latencies.append(time.perf_counter() - started)
+
+    # each wave models `concurrency` requests arriving on one worker at the same time
+    for _ in range(max(total // concurrency, 1)):
+        started = time.perf_counter()
+        await asyncio.gather(*[timed(started) for _ in range(concurrency)])
+    return latencies
+
+
+async def main(args):
+    from services import lens_service
+    from services.es_search import es, async_es
+    es.init_app()
+    async_es.init_app()
+
+    request = lens_service.get_search_request_for_args(lens_service.POSTS_INDEX,
+                                                       **lens_service.get_publications_search_args("lens"))
+
+    async def sync_handler():
+        # what the endpoints did before: a blocking call inside an async def
+        return es.search(**request)
+
+    async def async_handler():
+        return await lens_service.async_search_publications("lens")
+
+    print(f"{'mode':<6} {'concurrency':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, handler in (("sync", sync_handler), ("async", async_handler)):
+        for concurrency in args.concurrency:
+            latencies = await run_level(handler, concurrency, args.requests)
+            print(f"{mode:<6} {concurrency:>11} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f}")
+    await async_es.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="stub Elasticsearch latency in seconds")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    port = StubElasticsearch(latency=args.latency).start_in_thread()
+    os.environ["ES_HTTP_SERVICE_PORT"] = str(port)
+    os.environ["ES_HTTP_SERVICE_SCHEME"] = "http"
+    asyncio.run(main(args))
@@ -0,0 +1,50 @@
+"""Compare follower-fetch throughput in profiles/sec of the profile crawler across concurrency and
+aliased batch sizes, against the stub Lens API.
+
+    python -m benchmarks.crawler_throughput --latency 0.05 --profiles 200 --concurrency 1 4 8 --batch 1 10
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_lens_api import StubLensApi
+
+
+def main(args):
+    # the crawler is a script run from data/profiles
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "profiles"))
+    import data_ingest
+    data_ingest.rate_limiter = data_ingest.RateLimiter(args.rate_limit)
+    profile_ids = [hex(i) for i in range(1, args.profiles + 1)]
+
+    print(f"{'concurrency':>11} {'batch':>6} {'requests':>9} {'profiles/sec':>13}")
+    for concurrency in args.concurrency:
+        for batch in args.batch:
+            data_ingest.executor = ThreadPoolExecutor(max_workers=concurrency)
+            data_ingest.CRAWLER_FOLLOWERS_BATCH = batch
+            requests_before = stub.requests["followers"]
+            started = time.perf_counter()
+            followers = data_ingest.fetch_followers(profile_ids)
+            elapsed = time.perf_counter() - started
+            assert len(followers) == len(profile_ids)
+            print(f"{concurrency:>11} {batch:>6} {stub.requests['followers'] - requests_before:>9} "
+                  f"{len(profile_ids) / elapsed:>13.1f}")
+            data_ingest.executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="stub Lens API latency in seconds")
+    parser.add_argument("--profiles", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 10, 25])
+    parser.add_argument("--rate-limit", type=float, default=0, help="GraphQL requests per second, 0 disables")
+    args = parser.parse_args()
+
+    stub = StubLensApi(latency=args.latency, total_profiles=args.profiles)
+    os.environ["LENS_API_URL"] = f"http://127.0.0.1:{stub.start_in_thread()}/"
+    # only follower fetching is timed, Mongo is never contacted
+    os.environ.setdefault("MONGO_DB", "lens-benchmark")
+    main(args)
@@ -0,0 +1,49 @@
+"""Compare page-N latency of from/size paging against search_after cursors on the posts index.
+
+Needs a real Elasticsearch holding the posts index.
+
+    python -m benchmarks.deep_pagination --pages 1 10 50 100 500 --size 10
+"""
+import argparse
+import asyncio
+import time
+
+from services import lens_service
+from services.es_search import async_es
+
+
+async def timed(fn):
+    started = time.perf_counter()
+    res = await fn()
+    return res, (time.perf_counter() - started) * 1000
+
+
+async def main(args):
+    async_es.init_app()
+    print(f"{'page':>6} {'from ms':>9} {'cursor ms':>10}")
+    cursor = None
+    fetched = 0
+    for target in sorted(args.pages):
+        # walk the cursor chain up to the page before the target, only the target page is timed
+        while fetched < target - 1 and (fetched == 0 or cursor):
+            cursor = (await lens_service.async_search_publications(args.text, size=args.size, cursor=cursor))["next_cursor"]
+            fetched += 1
+        if target > 1 and not cursor:
+            print(f"{target:>6} results exhausted")
+            break
+        _, cursor_ms = await timed(lambda: lens_service.async_search_publications(args.text, page=target, size=args.size, cursor=cursor))
+        if target * args.size > args.max_result_window:
+            from_ms = float("nan")
+        else:
+            _, from_ms = await timed(lambda: lens_service.async_search_publications(args.text, page=target, size=args.size))
+        print(f"{target:>6} {from_ms:>9.1f} {cursor_ms:>10.1f}")
+    await async_es.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--text", default="")
+    parser.add_argument("--size", type=int, default=10)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 500, 1000])
+    parser.add_argument("--max-result-window", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
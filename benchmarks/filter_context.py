@@ -0,0 +1,49 @@
+"""Compare ES took-time of publication bodies with constraints in filter context against the same
+constraints as scoring must clauses.
+
+Needs a real Elasticsearch holding the posts index. Repeated runs let the filter cache warm up,
+which is where the filter-context bodies pull ahead.
+
+    python -m benchmarks.filter_context --app-id lenster --min-collects 1 --repeat 20
+"""
+import argparse
+import copy
+import statistics
+
+from services import lens_service
+from services.es_search import es
+
+
+def get_scoring_query(query):
+    # the pre-filter-context shape: every constraint scored in bool.must
+    scoring_query = copy.deepcopy(query)
+    bool_query = scoring_query["query"]["bool"]
+    bool_query["must"] += bool_query.pop("filter")
+    return scoring_query
+
+
+def get_took(body, repeat):
+    return [es.search(index=lens_service.POSTS_INDEX, body=body, request_cache=False)["took"] for _ in range(repeat)]
+
+
+def main(args):
+    es.init_app()
+    search_args = lens_service.get_publications_search_args(
+        args.text, app_id=args.app_id, min_collects=args.min_collects, min_profile_follower=args.min_profile_follower,
+        result_type=lens_service.ResultType(args.result_type))
+    query = lens_service.get_search_query(**search_args)
+    for name, body in (("must", get_scoring_query(query)), ("filter", query)):
+        took = get_took(body, args.repeat)
+        print(f"{name:<7} first {took[0]:>5} ms  median {statistics.median(took):>6.1f} ms  "
+              f"p90 {sorted(took)[int(len(took) * 0.9) - 1]:>5} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--text", default="")
+    parser.add_argument("--app-id")
+    parser.add_argument("--min-collects", type=int)
+    parser.add_argument("--min-profile-follower", type=int)
+    parser.add_argument("--result-type", default="latest", choices=[result_type.value for result_type in lens_service.ResultType])
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,73 @@
+"""Compare ingestion throughput in docs/sec of 100-document sync bulk calls against the background
+ingest pipeline.
+
+    python -m benchmarks.ingest_throughput --latency 0.02 --docs 20000 --flush-size 500 1000 2000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.stub_es import StubElasticsearch
+
+
+def get_contents(count: int):
+    return [{
+        "version": "1.0.0", "metadata_id": f"bench-{i}", "description": f"benchmark document {i}", "content": "gm lens",
+        "name": f"Post by bench-{i % 100}", "attributes": [], "media": [], "appId": "bench", "profileId": hex(i % 1000),
+    } for i in range(count)]
+
+
+def run_sync(count: int, batch_size: int):
+    from services import lens_service
+    contents = get_contents(count)
+    started = time.perf_counter()
+    # what indexers did before: one blocking POST /index per INDEXING_LIMIT documents
+    for i in range(0, count, batch_size):
+        lens_service.index_contents(contents[i:i + batch_size])
+    return count / (time.perf_counter() - started)
+
+
+async def run_pipeline(count: int, flush_size: int, workers: int):
+    from services.es_search import async_es
+    from services.ingest import IngestPipeline
+    pipeline = IngestPipeline(async_es, flush_size=flush_size, workers=workers, flush_interval=0.5)
+    await pipeline.start()
+    batch = pipeline.create_batch()
+    started = time.perf_counter()
+    for content in get_contents(count):
+        await pipeline.put(batch, content)
+    batch.closed = True
+    await pipeline.join()
+    elapsed = time.perf_counter() - started
+    await pipeline.stop()
+    assert batch.status == "done" and batch.indexed == count, batch.dict()
+    return count / elapsed
+
+
+async def main(args):
+    from services.es_search import es, async_es
+    es.init_app()
+    async_es.init_app()
+    print(f"{'mode':<10} {'batch':>6} {'workers':>8} {'docs/sec':>10}")
+    print(f"{'sync':<10} {args.sync_batch:>6} {1:>8} {run_sync(args.docs, args.sync_batch):>10.0f}")
+    for flush_size in args.flush_size:
+        for workers in args.workers:
+            docs_per_sec = await run_pipeline(args.docs, flush_size, workers)
+            print(f"{'pipeline':<10} {flush_size:>6} {workers:>8} {docs_per_sec:>10.0f}")
+    await async_es.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02, help="stub Elasticsearch latency in seconds")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--sync-batch", type=int, default=100)
+    parser.add_argument("--flush-size", type=int, nargs="+", default=[500, 1000, 2000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    port = StubElasticsearch(latency=args.latency).start_in_thread()
+    os.environ["ES_HTTP_SERVICE_PORT"] = str(port)
+    os.environ["ES_HTTP_SERVICE_SCHEME"] = "http"
+    asyncio.run(main(args))
@@ -0,0 +1,85 @@
+"""Compare per-request build-plus-encode time of async_search() bodies built as dicts against rendered query templates.
+
+Requests are the /publications and /profiles part of the replay benchmark's synthetic mix. Every rendered body is
+checked against the dict-built one before timing.
+
+    python -m benchmarks.query_build --requests 2000 --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date
+
+from elasticsearch.serializer import JSONSerializer
+
+from benchmarks.replay import get_synthetic_params
+from services import lens_service
+
+serializer = JSONSerializer()
+
+
+def get_search_args(rng: random.Random, path: str):
+    params = get_synthetic_params(rng, path)
+    page, size = params.pop("page"), params.pop("size")
+    if path == "/profiles":
+        args = lens_service.get_profiles_search_args(params["text"], None, None, params.get("min_follower"), None, None, None)
+    else:
+        for name in ("from_date", "to_date"):
+            if name in params:
+                params[name] = date.fromisoformat(params[name])
+        for name, enum in (("search_type", lens_service.SearchType), ("result_type", lens_service.ResultType),
+                           ("view", lens_service.ResponseView)):
+            if name in params:
+                params[name] = enum(params[name])
+        args = lens_service.get_publications_search_args(**params)
+    # some requests continue a cursor, inside a point in time or not
+    cursor = rng.random()
+    search_after = ["2022-05-01T00:00:00.000Z", "0x01-0x01"] if cursor < 0.2 else None
+    pit_id = "pit-id" if cursor < 0.1 else None
+    return {**args, "page": page, "size": size, "search_after": search_after, "pit_id": pit_id}
+
+
+def build_dict(args):
+    # the pre-template path: build the dict, then elasticsearch-py encodes it
+    query = lens_service.get_search_query(
+        args["must_query_field_values"], args["should_query_field_values"], args["search_type"],
+        args["gte_range_query_field_values"], args.get("prefix_field_values", {}), args.get("sort_by"), args["page"], args["size"],
+        term_field_values=args["term_field_values"], date_range_field_values=args.get("date_range_field_values", {}),
+        source_includes=args.get("source_includes"), field_boosts=args["field_boosts"],
+        suggestion_field=args["suggestion_field"])
+    request = lens_service.get_search_request("index", query, args["search_after"], args["pit_id"])
+    return serializer.dumps(request["body"])
+
+
+def build_template(args):
+    return serializer.dumps(lens_service.get_templated_search_request("index", **args)["body"])
+
+
+def time_per_request(build, requests, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for args in requests:
+            build(args)
+    return (time.perf_counter() - started) / (repeat * len(requests))
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    paths = rng.choices(["/publications", "/profiles"], weights=[3, 1], k=args.requests)
+    # hashtag search keeps the dict path, see get_search_request_for_args
+    requests = [request for request in (get_search_args(rng, path) for path in paths)
+                if request["search_type"] != lens_service.SearchType.hashtags]
+    for request in requests:
+        assert json.loads(build_template(request)) == json.loads(build_dict(request)), request
+    print(f"{len(requests)} requests, {len(lens_service._query_templates)} query templates")
+    for name, build in (("dict", build_dict), ("template", build_template)):
+        print(f"{name:<9} {time_per_request(build, requests, args.repeat) * 1e6:>7.1f} us/request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,249 @@
+"""Replay a recorded or synthetic query log against the app with local Elasticsearch, Redis and ArangoDB stand-ins.
+
+The app runs under uvicorn with its real startup (Redis cache, ES clients, ingest pipeline). Requests are sent
+over HTTP by --concurrency clients. The recorded format is one JSON object per line with "path", an optional
+"query" string and an optional "method". The app's "request timing" log records have this shape, so production
+logs can be replayed as they are, every request is in them at DEBUG or with REQUEST_TIMING_LOG_MIN_MS=0; records of
+non-GET requests are skipped. The stand-ins and clients share the
+process with the app, so reports are meant to be compared with each other rather than read as capacity numbers.
+
+    python -m benchmarks.replay --requests 2000 --concurrency 16 --output before.json
+    python -m benchmarks.replay --log access.ndjson --es-latency 0.02 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import aiohttp
+
+from benchmarks.stub_arango import StubArango
+from benchmarks.stub_es import StubElasticsearch
+from benchmarks.stub_redis import StubRedis
+
+WORDS = ["gm", "lens", "nft", "web3", "defi", "aave", "dao", "music", "art", "photo", "polygon", "crypto", "zk",
+         "eth", "build", "frens", "mirror", "collect", "stani", "lenster", "ipfs", "metaverse", "gaming", "social"]
+APP_IDS = ["lenster", "orb", "phaver", "lensfrens", "iris"]
+# relative weights of the endpoints in the synthetic mix
+ENDPOINT_WEIGHTS = {"/publications": 50, "/profiles": 15, "/nfts": 10, "/comments": 15, "/trends": 8, "/traverse": 2}
+# the headline numbers --compare reports, with whether a higher value is better
+COMPARED_METRICS = [("throughput_rps", True), ("latency_ms.p50", False), ("latency_ms.p95", False),
+                    ("latency_ms.p99", False), ("es_calls_per_request", False), ("cache.hit_rate", True)]
+
+
+def zipf_choice(rng: random.Random, values: list):
+    # popular queries repeat, which is what the caches live on
+    return rng.choices(values, weights=[1 / (rank + 1) for rank in range(len(values))])[0]
+
+
+def get_text(rng: random.Random):
+    return " ".join(zipf_choice(rng, WORDS) for _ in range(rng.choice([1, 1, 1, 2, 3])))
+
+
+def get_synthetic_params(rng: random.Random, path: str):
+    if path == "/publications":
+        params = {"text": get_text(rng), "page": rng.choice([1, 1, 1, 2, 3]), "size": rng.choice([10, 10, 20, 50])}
+        optional = {
+            "search_type": lambda: rng.choice(["any_words", "all_words", "exact_phrase", "hashtags"]),
+            "result_type": lambda: rng.choice(["latest", "top", "photo", "video", "links"]),
+            "min_collects": lambda: rng.choice([1, 5, 10]),
+            "min_mirror": lambda: rng.choice([1, 5]),
+            "min_comments": lambda: rng.choice([1, 3]),
+            "min_profile_follower": lambda: rng.choice([10, 100, 1000]),
+            "app_id": lambda: zipf_choice(rng, APP_IDS),
+            "from_users": lambda: f"{zipf_choice(rng, WORDS)}.lens",
+            "from_date": lambda: "2022-05-01",
+            "to_date": lambda: "2022-06-30",
+            "view": lambda: rng.choice(["compact", "card", "full"]),
+        }
+        for name, value in optional.items():
+            if rng.random() < 0.2:
+                params[name] = value()
+        return params
+    if path == "/profiles":
+        params = {"text": get_text(rng), "page": rng.choice([1, 1, 2]), "size": rng.choice([10, 20])}
+        if rng.random() < 0.3:
+            params["min_follower"] = rng.choice([10, 100, 1000])
+        return params
+    if path == "/nfts":
+        return {"text": get_text(rng), "search_type": rng.choice(["all_words", "any_words"]), "page": rng.choice([1, 1, 2])}
+    if path == "/comments":
+        return {"pub_id": f"0x{zipf_choice(rng, list(range(1, 200))):02x}-0x01", "page": rng.choice([1, 1, 2])}
+    if path == "/trends":
+        params = {"window": rng.choice(["1h", "24h", "48h", "7d"]), "size": rng.choice([10, 20])}
+        if rng.random() < 0.3:
+            params["app_id"] = zipf_choice(rng, APP_IDS)
+        return params
+    return {"start": hex(zipf_choice(rng, list(range(1, 500)))), "max_depth": rng.choice([1, 2]), "limit": 100}
+
+
+def get_synthetic_log(requests: int, seed: int):
+    rng = random.Random(seed)
+    paths = rng.choices(list(ENDPOINT_WEIGHTS), weights=list(ENDPOINT_WEIGHTS.values()), k=requests)
+    return [{"method": "GET", "path": path, "query": urlencode(get_synthetic_params(rng, path))} for path in paths]
+
+
+def read_log(path: str):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "path" in entry and entry.get("method", "GET") == "GET":
+                entries.append({"method": "GET", "path": entry["path"], "query": entry.get("query", "")})
+    return entries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] if values else 0
+
+
+def get_latency_summary(latencies):
+    return {"p50": round(percentile(latencies, 50) * 1000, 3), "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0}
+
+
+def get_cache_summary(counters):
+    def total(name, tier):
+        return sum(value for key, value in counters.items() if key.startswith(f"{name}{{") and f'tier="{tier}"' in key)
+
+    l1_hits, l1_misses = total("cache_hits_total", "l1"), total("cache_misses_total", "l1")
+    l2_hits, l2_misses = total("cache_hits_total", "l2"), total("cache_misses_total", "l2")
+    lookups = l1_hits + l1_misses
+    return {"lookups": lookups, "l1_hits": l1_hits, "l2_hits": l2_hits, "misses": l2_misses,
+            "hit_rate": round((l1_hits + l2_hits) / lookups, 4) if lookups else 0,
+            "l1_hit_rate": round(l1_hits / lookups, 4) if lookups else 0,
+            "l2_hit_rate": round(l2_hits / (l2_hits + l2_misses), 4) if l2_hits + l2_misses else 0}
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def replay(base_url: str, entries, concurrency: int):
+    results = []
+    queue = iter(entries)
+
+    async def client(session):
+        for entry in queue:
+            url = f"{base_url}{entry['path']}" + (f"?{entry['query']}" if entry["query"] else "")
+            started = time.perf_counter()
+            async with session.get(url) as response:
+                await response.read()
+            results.append((entry["path"], response.status, time.perf_counter() - started))
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+        return results, time.perf_counter() - started
+
+
+async def run(args, entries, stubs):
+    import uvicorn
+    from app import get_application
+    from services.metrics import get_metrics
+
+    port = get_free_port()
+    server = uvicorn.Server(uvicorn.Config(get_application(), host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    # startup traffic (index checks, redis handshake) is not part of the replay
+    before = {name: sum(stub.requests.values()) for name, stub in stubs.items()}
+    counters_before = get_metrics()["counters"]
+    try:
+        results, elapsed = await replay(f"http://127.0.0.1:{port}", entries, args.concurrency)
+    finally:
+        server.should_exit = True
+        await serving
+    counters = {key: value - counters_before.get(key, 0) for key, value in get_metrics()["counters"].items()}
+    calls = {name: sum(stub.requests.values()) - before[name] for name, stub in stubs.items()}
+
+    per_endpoint = defaultdict(list)
+    for path, _, latency in results:
+        per_endpoint[path].append(latency)
+    latencies = [latency for _, _, latency in results]
+    return {
+        "label": args.label,
+        "config": {"requests": len(entries), "log": args.log, "seed": args.seed, "concurrency": args.concurrency,
+                   "es_latency": args.es_latency, "redis_latency": args.redis_latency,
+                   "arango_latency": args.arango_latency, "total_hits": args.total_hits},
+        "requests": len(results),
+        "errors": sum(status >= 400 for _, status, _ in results),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "latency_ms": get_latency_summary(latencies),
+        "es_calls_per_request": round(calls["es"] / len(results), 4) if results else 0,
+        "backend_calls": calls,
+        "cache": get_cache_summary(counters),
+        "endpoints": {path: {"requests": len(values), **get_latency_summary(values)} for path, values in sorted(per_endpoint.items())},
+    }
+
+
+def get_value(report: dict, name: str):
+    for part in name.split("."):
+        report = report[part]
+    return report
+
+
+def print_comparison(base: dict, report: dict):
+    print(f"{'metric':<24}{base['label'] or 'base':>12}{report['label'] or 'run':>12}{'change':>10}")
+    for name, higher_is_better in COMPARED_METRICS:
+        old, new = get_value(base, name), get_value(report, name)
+        change = (new - old) / old * 100 if old else 0
+        better = (change > 0) == higher_is_better if change else None
+        print(f"{name:<24}{old:>12}{new:>12}{change:>+9.1f}%" + {True: " better", False: " worse", None: ""}[better])
+
+
+def main(args):
+    entries = read_log(args.log) if args.log else get_synthetic_log(args.requests, args.seed)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    stubs = {"es": StubElasticsearch(latency=args.es_latency, total_hits=args.total_hits),
+             "redis": StubRedis(latency=args.redis_latency), "arango": StubArango(latency=args.arango_latency)}
+    ports = {name: stub.start_in_thread() for name, stub in stubs.items()}
+    os.environ.update({
+        "ES_HTTP_SERVICE_PORT": str(ports["es"]), "ES_HTTP_SERVICE_SCHEME": "http",
+        "REDIS_HOST": "127.0.0.1", "REDIS_PORT": str(ports["redis"]), "REDIS_PASSWORD": "",
+        "GRAPHDB_HOST": f"http://127.0.0.1:{ports['arango']}",
+    })
+    # background jobs would add backend calls that no request made
+    os.environ.setdefault("TRENDS_MATERIALIZER_ENABLED", "false")
+
+    report = asyncio.run(run(args, entries, stubs))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", help="recorded query log to replay, a synthetic log is generated when omitted")
+    parser.add_argument("--requests", type=int, default=2000, help="size of the synthetic log")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--record", help="also write the replayed log here, to replay the exact same requests later")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--es-latency", type=float, default=0.02)
+    parser.add_argument("--redis-latency", type=float, default=0.001)
+    parser.add_argument("--arango-latency", type=float, default=0.01)
+    parser.add_argument("--total-hits", type=int, default=1000, help="hits of every stub search, 0 exercises the suggestion retry")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to print the headline metrics against")
+    main(parser.parse_args())
@@ -0,0 +1,94 @@
+"""Compare CPU per request of the stdlib json response path against the single orjson encoding.
+
+Each path is timed for a cache miss, a Redis (L2) hit and a worker-local (L1) hit on one page of
+publications. Miss times exclude the ES round trip, which both paths share.
+
+    python -m benchmarks.serialization_cpu --hits 50 --repeat 2000
+"""
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache.coder import JsonCoder
+from starlette.responses import JSONResponse
+
+from app.cache import CachedJSONResponse, ORJSONCoder
+from services import lens_service
+
+
+def get_hit(i: int):
+    # the shape of a posts document, nested profile, stats and media included
+    return {
+        "id": f"0x01-0x{i:04x}",
+        "createdAt": "2022-05-01T00:00:00.000Z",
+        "appId": "lenster",
+        "metadata": {"name": f"Post by stani #{i}", "description": "gm " * 40, "content": "gm frens, building on lens " * 20,
+                     "media": [{"original": {"url": f"ipfs://Qm{i:044d}", "mimeType": "image/png"}}] * 2,
+                     "attributes": [{"traitType": "type", "value": "post", "displayType": "string"}]},
+        "profile": {"id": "0x01", "name": "Stani Kulechov", "handle": "stani.lens", "bio": "building " * 20,
+                    "ownedBy": "0x7241dddec3a6af367882eaf9651b87e1c7549dff", "location": "London", "twitterUrl": "stanikulechov",
+                    "picture": {"original": {"url": "ipfs://QmPicture", "mimeType": "image/jpeg"}},
+                    "stats": {"totalFollowers": 12000 + i, "totalFollowing": 200, "totalPosts": 900, "totalComments": 300,
+                              "totalMirrors": 100, "totalPublications": 1300, "totalCollects": 50}},
+        "stats": {"totalAmountOfMirrors": i, "totalAmountOfCollects": i * 2, "totalAmountOfComments": i * 3},
+    }
+
+
+def get_page(hits: int):
+    res = {"hits": {"total": {"value": 10000, "relation": "eq"}, "hits": [{"_source": get_hit(i)} for i in range(hits)]}}
+    return lens_service.get_publications_response(res, "gm", None, None, None, 1, "cursor")
+
+
+def render(value):
+    # what FastAPI does with a returned dict: jsonable_encoder, then JSONResponse's json.dumps
+    return JSONResponse(jsonable_encoder(value)).body
+
+
+def json_miss(page):
+    JsonCoder.encode(page)
+    return render(page)
+
+
+def json_l2_hit(encoded):
+    return render(JsonCoder.decode(encoded))
+
+
+def orjson_miss(page):
+    return CachedJSONResponse(ORJSONCoder.decode(ORJSONCoder.encode(page))).body
+
+
+def orjson_l2_hit(encoded):
+    # aioredis hands back str, the pool is opened with encoding="utf8"
+    return CachedJSONResponse(ORJSONCoder.decode(encoded.decode())).body
+
+
+def cpu_per_call(func, arg, repeat: int):
+    started = time.process_time()
+    for _ in range(repeat):
+        func(arg)
+    return (time.process_time() - started) / repeat
+
+
+def main(args):
+    page = get_page(args.hits)
+    json_encoded = JsonCoder.encode(page)
+    orjson_encoded = ORJSONCoder.encode(page)
+    assert json.loads(render(page)) == json.loads(orjson_miss(page))
+    print(f"{args.hits} hits, {len(render(page)) / 1024:.1f} KB body, CPU per request")
+    print(f"{'path':<8}{'miss':>10}{'L2 hit':>10}{'L1 hit':>10}")
+    rows = (
+        ("json", cpu_per_call(json_miss, page, args.repeat), cpu_per_call(json_l2_hit, json_encoded, args.repeat),
+         cpu_per_call(render, page, args.repeat)),
+        ("orjson", cpu_per_call(orjson_miss, page, args.repeat), cpu_per_call(orjson_l2_hit, orjson_encoded, args.repeat),
+         cpu_per_call(CachedJSONResponse, orjson_encoded, args.repeat)),
+    )
+    for name, miss, l2_hit, l1_hit in rows:
+        print(f"{name:<8}{miss * 1e6:>8.0f}us{l2_hit * 1e6:>8.0f}us{l1_hit * 1e6:>8.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hits", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=2000)
+    main(parser.parse_args())
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import json
+
+from benchmarks.stub_es import StubElasticsearch
+
+
+class StubArango(StubElasticsearch):
+    """Local stand-in for ArangoDB answering AQL cursors with a canned traversal of ``vertices`` profiles."""
+
+    def __init__(self, latency: float = 0.01, vertices: int = 50):
+        super().__init__(latency=latency)
+        self.vertices = vertices
+
+    def route(self, method, path, body):
+        if path.endswith("/_api/cursor"):
+            self.requests["cursor"] += 1
+            bind_vars = json.loads(body).get("bindVars", {}) if body else {}
+            start = bind_vars.get("start", "profiles/0x01")
+            vertices = [{"_id": f"profiles/{i}", "_key": str(i), "id": hex(i), "handle": f"stub{i}.lens"}
+                        for i in range(min(self.vertices, bind_vars.get("limit", self.vertices)))]
+            if start.endswith("/missing"):
+                return {"result": [], "hasMore": False, "cached": False, "error": False, "code": 201}
+            start_vertex = {"_id": start, "_key": start.split("/")[-1]}
+            paths = [{"edges": [{"_from": start, "_to": vertex["_id"]}], "vertices": [start_vertex, vertex]} for vertex in vertices]
+            return {"result": [{"vertices": [start_vertex] + vertices, "paths": [{"edges": [], "vertices": [start_vertex]}] + paths}],
+                    "hasMore": False, "cached": False, "error": False, "code": 201}
+        self.requests["other"] += 1
+        return {"server": "arango", "version": "3.8.0", "error": False, "code": 200}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local ArangoDB stand-in.")
+    parser.add_argument("--port", type=int, default=8529)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    async def main():
+        stub = StubArango(latency=args.latency)
+        port = await stub.start(port=args.port)
+        print(f"Stub ArangoDB listening on http://127.0.0.1:{port}/")
+        await stub.server.serve_forever()
+
+    asyncio.run(main())
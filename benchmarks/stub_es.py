@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import threading
+from collections import Counter
+
+
+class StubElasticsearch:
+    """Local stand-in for Elasticsearch that answers with canned documents after a fixed latency."""
+
+    def __init__(self, latency: float = 0.02, total_hits: int = 1000):
+        self.latency = latency
+        self.total_hits = total_hits
+        self.requests = Counter()
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        result = {}
+
+        def run():
+            asyncio.set_event_loop(loop)
+            result["port"] = loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return result["port"]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                await asyncio.sleep(self.latency)
+                payload = json.dumps(self.route(method, path.split("?")[0], body)).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                             b"content-length: %d\r\n\r\n" % len(payload) + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method, path, body):
+        if path.endswith("/_msearch"):
+            self.requests["msearch"] += 1
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            return {"took": 1, "responses": [self.search_response(query) for query in lines[1::2]]}
+        if path.endswith("/_search"):
+            self.requests["search"] += 1
+            return self.search_response(json.loads(body) if body else {})
+        if path.endswith("/_bulk"):
+            self.requests["bulk"] += 1
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            items = [{action: {"_id": meta.get("_id"), "status": 201, "result": "created"}}
+                     for header in lines if isinstance(header, dict) and len(header) == 1
+                     for action, meta in header.items() if action in ("index", "create", "update", "delete")]
+            return {"took": 1, "errors": False, "items": items}
+        if path.endswith("/_pit"):
+            self.requests["pit"] += 1
+            return {"id": "stub-pit", "succeeded": True}
+        self.requests["other"] += 1
+        return {"version": {"number": "7.13.0"}, "tagline": "You Know, for Search"}
+
+    def aggregations_response(self, aggs):
+        response = {}
+        for name, agg in aggs.items():
+            sub_aggs = agg.get("aggs", {})
+            if "sampler" in agg:
+                # single bucket aggregations nest their sub-aggregations directly
+                response[name] = {"doc_count": 100, **self.aggregations_response(sub_aggs)}
+            else:
+                response[name] = {"buckets": [{"key": f"term{i}", "doc_count": 10 - i, **self.aggregations_response(sub_aggs)}
+                                              for i in range(10)]}
+        return response
+
+    def suggester_response(self, suggester):
+        if "completion" in suggester:
+            prefix = suggester.get("prefix", "")
+            kinds = suggester["completion"].get("contexts", {}).get("kind", ["handle"])
+            options = [{"text": f"{prefix}{i}", "_index": "stub", "_id": f"{kinds[i % len(kinds)]}:{prefix}{i}",
+                        "_score": float(100 - i), "_source": {"kind": kinds[i % len(kinds)], "value": f"{prefix}{i}"}}
+                       for i in range(suggester["completion"].get("size", 5))]
+            return {"text": prefix, "offset": 0, "length": len(prefix), "options": options}
+        return {"text": suggester.get("text", ""), "offset": 0, "length": 1,
+                "options": [{"text": "lens", "score": 0.8, "freq": 10}]}
+
+    def search_response(self, query):
+        size = query.get("size", 10)
+        offset = query.get("from", 0)
+        if query.get("search_after"):
+            # continues after the hit the cursor points at, whose last sort value is its id
+            offset = int(query["search_after"][-1].rsplit("-0x", 1)[1], 16) + 1
+        hits = [{
+            "_index": "stub",
+            "_id": str(offset + i),
+            "_score": 1.0,
+            "_source": {"id": f"0x01-0x{offset + i:02x}", "createdAt": "2022-05-01T00:00:00.000Z",
+                        "metadata": {"content": "stub publication " * 20}, "profile": {"handle": "stub.lens"}},
+            "sort": ["2022-05-01T00:00:00.000Z", f"0x01-0x{offset + i:02x}"]
+        } for i in range(min(size, max(self.total_hits - offset, 0)))]
+        response = {"took": 1, "timed_out": False,
+                    "hits": {"total": {"value": self.total_hits, "relation": "eq"}, "hits": hits}}
+        if query.get("aggs"):
+            response["aggregations"] = self.aggregations_response(query["aggs"])
+        if query.get("suggest"):
+            response["suggest"] = {name: [self.suggester_response(suggester)]
+                                   for name, suggester in query["suggest"].items() if isinstance(suggester, dict)}
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Elasticsearch stand-in.")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    async def main():
+        stub = StubElasticsearch(latency=args.latency)
+        port = await stub.start(port=args.port)
+        print(f"Stub Elasticsearch listening on 127.0.0.1:{port}")
+        await stub.server.serve_forever()
+
+    asyncio.run(main())
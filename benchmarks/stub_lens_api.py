@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import json
+import re
+
+from benchmarks.stub_es import StubElasticsearch
+
+FOLLOWERS_FIELD = re.compile(r'(?:(\w+)\s*:\s*)?followers\s*\(\s*request\s*:\s*\{\s*profileId\s*:\s*"([^"]+)"'
+                             r'(?:\s*,?\s*cursor\s*:\s*"(\d*)")?')
+PAGE_SIZE = 50
+PROFILE_IDS = re.compile(r'profileIds\s*:\s*\[([^\]]*)\]')
+
+
+class StubLensApi(StubElasticsearch):
+    """Local stand-in for the Lens GraphQL API serving ``total_profiles`` profiles with canned followers."""
+
+    def __init__(self, latency: float = 0.05, total_profiles: int = 1000, followers: int = 50):
+        super().__init__(latency=latency)
+        self.total_profiles = total_profiles
+        self.followers = followers
+
+    def route(self, method, path, body):
+        query = json.loads(body)["query"] if body else ""
+        if "ping" in query:
+            self.requests["ping"] += 1
+            return {"data": {"query": "pong"}}
+        match = PROFILE_IDS.search(query)
+        if match:
+            self.requests["profiles"] += 1
+            ids = [int(profile_id, 16) for profile_id in re.findall(r'"([^"]+)"', match.group(1))]
+            return {"data": {"profiles": {"items": [self.get_profile(profile_id) for profile_id in ids
+                                                    if profile_id <= self.total_profiles]}}}
+        self.requests["followers"] += 1
+        return {"data": {alias or "followers": self.get_followers_page(profile_id, int(cursor or 0))
+                         for alias, profile_id, cursor in FOLLOWERS_FIELD.findall(query)}}
+
+    def get_followers_page(self, profile_id: str, offset: int):
+        # like the real API, `next` is set on every page and an exhausted cursor returns no items
+        return {
+            "items": [{"wallet": {"address": f"0x{profile_id}{i:04x}", "defaultProfile": {"id": hex(i + 1)}}}
+                      for i in range(offset, min(offset + PAGE_SIZE, self.followers))],
+            "pageInfo": {"next": str(offset + PAGE_SIZE), "totalCount": self.followers},
+        }
+
+    def get_profile(self, profile_id: int):
+        return {
+            "id": hex(profile_id), "handle": f"stub{profile_id}.lens", "ownedBy": f"0x{profile_id:040x}",
+            "stats": {"totalFollowers": self.followers, "totalFollowing": 0, "totalPosts": profile_id % 7,
+                      "totalComments": 0, "totalMirrors": 0, "totalPublications": profile_id % 7, "totalCollects": 0},
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Lens GraphQL API stand-in.")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--total-profiles", type=int, default=1000)
+    parser.add_argument("--followers", type=int, default=50, help="followers of every profile")
+    args = parser.parse_args()
+
+    async def main():
+        stub = StubLensApi(latency=args.latency, total_profiles=args.total_profiles, followers=args.followers)
+        port = await stub.start(port=args.port)
+        print(f"Stub Lens API listening on http://127.0.0.1:{port}/")
+        await stub.server.serve_forever()
+
+    asyncio.run(main())
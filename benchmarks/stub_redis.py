@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import threading
+import time
+from collections import Counter
+
+
+class StubRedis:
+    """Local stand-in for Redis speaking enough RESP for aioredis and fastapi-cache, with a fixed round-trip latency."""
+
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self.requests = Counter()
+        self.data = {}
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        result = {}
+
+        def run():
+            asyncio.set_event_loop(loop)
+            result["port"] = loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return result["port"]
+
+    async def handle(self, reader, writer):
+        buffer = b""
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                commands, buffer = parse_commands(buffer)
+                if not commands:
+                    continue
+                # a pipeline arrives in one write and pays one round trip, like against a real server
+                await asyncio.sleep(self.latency)
+                writer.write(b"".join(self.execute(command) for command in commands))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, command):
+        name, args = command[0].decode().upper(), command[1:]
+        self.requests[name.lower()] += 1
+        if name in ("AUTH", "SELECT", "CLIENT"):
+            return b"+OK\r\n"
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "GET":
+            return encode_bulk(self.get(args[0]))
+        if name == "TTL":
+            if self.get(args[0]) is None:
+                return b":-2\r\n"
+            expires_at = self.data[args[0]][1]
+            return b":%d\r\n" % (int(expires_at - time.monotonic()) if expires_at else -1)
+        if name == "SET":
+            return self.set(args[0], args[1], [arg.decode().upper() for arg in args[2:]])
+        if name == "DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, options):
+        expires_at = None
+        if "EX" in options:
+            expires_at = time.monotonic() + int(options[options.index("EX") + 1])
+        if "PX" in options:
+            expires_at = time.monotonic() + int(options[options.index("PX") + 1]) / 1000
+        exists = self.get(key) is not None
+        if ("NX" in options and exists) or ("XX" in options and not exists):
+            return b"$-1\r\n"
+        self.data[key] = (value, expires_at)
+        return b"+OK\r\n"
+
+
+def encode_bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def parse_commands(buffer: bytes):
+    """Splits complete RESP arrays of bulk strings off ``buffer``, returns them and the unparsed rest."""
+    commands = []
+    while buffer.startswith(b"*"):
+        position = buffer.find(b"\r\n")
+        if position < 0:
+            break
+        count = int(buffer[1:position])
+        position += 2
+        command = []
+        for _ in range(count):
+            end = buffer.find(b"\r\n", position)
+            if end < 0:
+                break
+            length = int(buffer[position + 1:end])
+            if len(buffer) < end + 2 + length + 2:
+                break
+            command.append(buffer[end + 2:end + 2 + length])
+            position = end + 2 + length + 2
+        if len(command) < count:
+            break
+        commands.append(command)
+        buffer = buffer[position:]
+    return commands, buffer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Redis stand-in.")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--latency", type=float, default=0.001)
+    args = parser.parse_args()
+
+    async def main():
+        stub = StubRedis(latency=args.latency)
+        port = await stub.start(port=args.port)
+        print(f"Stub Redis listening on redis://127.0.0.1:{port}/")
+        await stub.server.serve_forever()
+
+    asyncio.run(main())
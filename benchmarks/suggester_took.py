@@ -0,0 +1,47 @@
+"""Compare ES took-time of publication queries under the per-field, single-field and lazy suggestion strategies.
+
+Needs a real Elasticsearch holding the posts index; the corpus is one search text per line.
+
+    python -m benchmarks.suggester_took --corpus queries.txt --repeat 5
+"""
+import argparse
+import statistics
+
+from services import lens_service
+from services.lens_service import SuggestionStrategy
+from services.es_search import es
+
+
+def get_took(body, repeat):
+    # request_cache would hide the suggester cost after the first run
+    return [es.search(index=lens_service.POSTS_INDEX, body=body, request_cache=False)["took"] for _ in range(repeat)]
+
+
+def main(args):
+    es.init_app()
+    with open(args.corpus) as corpus:
+        texts = [line.strip() for line in corpus if line.strip()]
+
+    took = {strategy: [] for strategy in SuggestionStrategy}
+    zero_hits = 0
+    for text in texts:
+        search_args = lens_service.get_publications_search_args(text)
+        for strategy in took:
+            took[strategy] += get_took(lens_service.get_search_query(**search_args, suggestion_strategy=strategy), args.repeat)
+        if not es.search(index=lens_service.POSTS_INDEX, body=lens_service.get_search_query(**search_args))["hits"]["hits"]:
+            zero_hits += 1
+            # the lazy strategy pays for one extra suggest-only request on zero hits
+            suggestion_query = lens_service.get_suggestion_query(lens_service.MultiSearchEndpoint.publications, text)
+            took[SuggestionStrategy.lazy] += get_took(suggestion_query, 1)
+
+    print(f"{len(texts)} queries, {zero_hits} with zero hits")
+    for strategy, values in took.items():
+        print(f"{strategy.value:<13} total {sum(values):>8} ms  mean {statistics.mean(values):>7.2f} ms  "
+              f"median {statistics.median(values):>6.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", required=True, help="file with one recorded search text per line")
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
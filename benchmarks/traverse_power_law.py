@@ -0,0 +1,94 @@
+"""Compare /traverse latency of the python-arango traversal API against the bounded AQL traversal on a
+synthetic power-law (preferential attachment) follower graph.
+
+Needs a real ArangoDB (GRAPHDB_HOST / GRAPHDB_PASSWORD). The graph is loaded into its own database,
+which is dropped afterwards unless --keep is given.
+
+    python -m benchmarks.traverse_power_law --vertices 20000 --edges-per-vertex 5 --depth 1 2 3
+"""
+import argparse
+import os
+from collections import Counter
+import random
+import statistics
+import time
+
+from arango import ArangoClient
+
+from app.custom_http_client import CustomHTTPClient
+from services import graph_service
+
+BENCH_DB = "lens_traverse_bench"
+
+
+def get_power_law_edges(vertices: int, edges_per_vertex: int, seed: int):
+    # Barabasi-Albert: every new profile follows existing ones in proportion to their follower count
+    rng = random.Random(seed)
+    targets = list(range(edges_per_vertex))
+    for source in range(edges_per_vertex, vertices):
+        for target in {rng.choice(targets) for _ in range(edges_per_vertex)}:
+            yield source, target
+            targets.append(target)
+        targets.append(source)
+
+
+def load_graph(db, args):
+    graph = db.create_graph(graph_service.PROFILES_GRAPH, edge_definitions=[{
+        "edge_collection": "follows", "from_vertex_collections": [graph_service.PROFILES_COLLECTION],
+        "to_vertex_collections": [graph_service.PROFILES_COLLECTION],
+    }])
+    profiles = graph.vertex_collection(graph_service.PROFILES_COLLECTION)
+    profiles.import_bulk([{"_key": str(i), "id": hex(i), "handle": f"bench{i}.lens", "bio": "x" * 200}
+                          for i in range(args.vertices)], batch_size=10000)
+    edges = list(get_power_law_edges(args.vertices, args.edges_per_vertex, args.seed))
+    graph.edge_collection("follows").import_bulk([
+        {"_from": f"{graph_service.PROFILES_COLLECTION}/{source}", "_to": f"{graph_service.PROFILES_COLLECTION}/{target}"}
+        for source, target in edges
+    ], batch_size=10000)
+    followers = Counter(target for _, target in edges)
+    return graph, str(followers.most_common(1)[0][0])
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies)
+
+
+def main(args):
+    client = ArangoClient(hosts=os.environ.get("GRAPHDB_HOST"), http_client=CustomHTTPClient())
+    sys_db = client.db("_system", username="root", password=os.environ.get("GRAPHDB_PASSWORD"))
+    if sys_db.has_database(BENCH_DB):
+        sys_db.delete_database(BENCH_DB)
+    sys_db.create_database(BENCH_DB)
+    db = client.db(BENCH_DB, username="root", password=os.environ.get("GRAPHDB_PASSWORD"))
+    try:
+        graph, hub = load_graph(db, args)
+        # the last vertex joined last, so it only has its own few outbound edges
+        starts = {"hub": hub, "median": str(args.vertices // 2), "leaf": str(args.vertices - 1)}
+        print(f"{'start':<7} {'depth':>5} {'traverse ms':>12} {'aql ms':>8} {'vertices':>9}")
+        for name, start in starts.items():
+            for depth in args.depth:
+                old_ms = timed(lambda: graph.traverse(start_vertex=f"{graph_service.PROFILES_COLLECTION}/{start}",
+                                                      direction="any", max_depth=depth), args.repeat)
+                new_ms = timed(lambda: graph_service.get_traversal(db, start, depth, "any", args.limit), args.repeat)
+                vertices = len(graph_service.get_traversal(db, start, depth, "any", args.limit)["vertices"])
+                print(f"{name:<7} {depth:>5} {old_ms:>12.1f} {new_ms:>8.1f} {vertices:>9}")
+    finally:
+        if not args.keep:
+            sys_db.delete_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vertices", type=int, default=20000)
+    parser.add_argument("--edges-per-vertex", type=int, default=5)
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--limit", type=int, default=graph_service.TRAVERSE_MAX_VERTICES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true")
+    main(parser.parse_args())
@@ -1,9 +1,19 @@
 from gql import gql, Client
+from gql.transport.exceptions import TransportError, TransportQueryError
 from gql.transport.requests import RequestsHTTPTransport
-from queries import get_profiles_query, get_followers_query
+from queries import get_profiles_query, get_followers_query, get_batch_followers_query
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import json
+import random
+import threading
 import time
+import requests
 from pymongo import MongoClient
-from pymongo.operations import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.operations import DeleteMany, InsertOne, UpdateOne
 import os
 
 MONGO_HOST = os.environ.get('MONGO_HOST', 'localhost')
@@ -12,83 +22,289 @@ MONGO_USER = os.environ.get('MONGO_USER', '')
 MONGO_PASS = os.environ.get('MONGO_PASSWORD', '')
 MONGO_DB = os.environ.get('MONGO_DB', '')
 
+LENS_API_URL = os.environ.get('LENS_API_URL', 'https://api-mumbai.lens.dev/')
+# worker threads fetching followers, 1 keeps the old one-request-at-a-time crawl
+CRAWLER_CONCURRENCY = int(os.environ.get('CRAWLER_CONCURRENCY', 8))
+# GraphQL requests per second across all workers, 0 disables the limit
+CRAWLER_RATE_LIMIT = float(os.environ.get('CRAWLER_RATE_LIMIT', 10))
+# profiles whose followers are aliased into one GraphQL document
+CRAWLER_FOLLOWERS_BATCH = int(os.environ.get('CRAWLER_FOLLOWERS_BATCH', 10))
+CRAWLER_MAX_RETRIES = int(os.environ.get('CRAWLER_MAX_RETRIES', 5))
+CRAWLER_BACKOFF = float(os.environ.get('CRAWLER_BACKOFF', 0.5))
+CRAWLER_WINDOW_SLEEP = float(os.environ.get('CRAWLER_WINDOW_SLEEP', 1))
+# consecutive empty 50-id windows past the highest known profile id that end a pass
+CRAWLER_EMPTY_WINDOWS = int(os.environ.get('CRAWLER_EMPTY_WINDOWS', 50))
+CRAWLER_PASS_SLEEP = float(os.environ.get('CRAWLER_PASS_SLEEP', 60))
+# keep the follower id list on each profile document, the profiles graph loader reads it, lens-follower-edges is always written
+EMBED_FOLLOWER_IDS = os.environ.get('EMBED_FOLLOWER_IDS', 'true').lower() == 'true'
+# keep the handle/name typeahead index in step with changed profiles, needs the repo root on PYTHONPATH and ES_* env
+CRAWLER_SUGGEST = os.environ.get('CRAWLER_SUGGEST', 'false').lower() == 'true'
+# copy changed profile stats into the posts embedding them, same requirements as CRAWLER_SUGGEST
+CRAWLER_STATS_SYNC = os.environ.get('CRAWLER_STATS_SYNC', 'false').lower() == 'true'
+
+if CRAWLER_SUGGEST or CRAWLER_STATS_SYNC:
+    from services.es_search import es
+if CRAWLER_SUGGEST:
+    from elasticsearch import helpers
+    from services.suggest import SuggestionKind, get_suggest_action
+if CRAWLER_STATS_SYNC:
+    from services.lens_service import POSTS_INDEX
+    from services.profile_stats import sync_profile_stats
+
 mongo_client = MongoClient(host=MONGO_HOST, port=MONGO_PORT, username=MONGO_USER, password=MONGO_PASS)
 
 db = mongo_client[MONGO_DB]
 collection = db['lens-profiles']
+state_collection = db['lens-crawler-state']
+edges_collection = db['lens-follower-edges']
+CHECKPOINT_ID = 'profiles'
+
+
+class RateLimiter:
+    """Spaces calls from any number of threads at least 1/rate seconds apart."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_at, now)
+            self.next_at = wait_until + self.interval
+        time.sleep(wait_until - now)
+
 
+rate_limiter = RateLimiter(CRAWLER_RATE_LIMIT)
+executor = ThreadPoolExecutor(max_workers=CRAWLER_CONCURRENCY)
+local = threading.local()
 
-# build the request framework
-transport = RequestsHTTPTransport(url="https://api-mumbai.lens.dev/", use_json=True)
 
-# create the client
-client = Client(transport=transport, fetch_schema_from_transport=True)
+def get_session():
+    # gql sessions hold one requests.Session each and are not thread safe, so every worker keeps its own
+    session = getattr(local, 'session', None)
+    if session is None:
+        client = Client(transport=RequestsHTTPTransport(url=LENS_API_URL, use_json=True))
+        session = local.session = client.connect_sync()
+    return session
 
-# define a query
-query = gql("""{query: ping}""")
-response = client.execute(query)
 
-if response['query']=='pong':
-    print("Connection established!!!")
+def execute(query: str):
+    for attempt in range(CRAWLER_MAX_RETRIES + 1):
+        rate_limiter.wait()
+        try:
+            return get_session().execute(gql(query))
+        except TransportQueryError:
+            raise
+        except (TransportError, requests.RequestException) as e:
+            if attempt == CRAWLER_MAX_RETRIES:
+                raise
+            delay = CRAWLER_BACKOFF * 2 ** attempt * (1 + random.random())
+            print(f"GraphQL request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
 
 count = 1
 
 total_user_ids = set()
 total_user_addresses = set()
+pass_stats = Counter()
+
+def get_fingerprint(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+def load_checkpoint():
+    # `count` is the next window to crawl, so a restarted crawler resumes mid-pass
+    return state_collection.find_one({"_id": CHECKPOINT_ID}) or {"_id": CHECKPOINT_ID, "count": 1, "max_profile_id": 0}
+
+def save_checkpoint(checkpoint):
+    checkpoint['updated_at'] = datetime.now().isoformat()
+    state_collection.replace_one({"_id": CHECKPOINT_ID}, checkpoint, upsert=True)
+
+def get_stored_fingerprints(entries):
+    profile_ids = [int(entry['id'], base=16) for entry in entries]
+    return {doc['_id']: doc for doc in collection.find({"_id": {"$in": profile_ids}}, {"_fingerprint": 1, "_stats_fingerprint": 1, "stats.totalFollowers": 1})}
 
 def get_user_profiles(user_ids):
-    query = gql(get_profiles_query(user_ids))
-    response = client.execute(query)
+    response = execute(get_profiles_query(user_ids))
     return response.get("profiles", []).get("items", [])
 
+def get_follower_ids(followers_response):
+    followers = []
+    for elm in (followers_response or {}).get('items', []):
+        wallet = elm.get('wallet')
+        if wallet and wallet.get('defaultProfile'):
+            if wallet.get('defaultProfile', {}).get('id'):
+                followers.append(wallet.get('defaultProfile', {}).get('id'))
+    return followers
+
+def fetch_all_followers(profile_id, page):
+    followers = get_follower_ids(page)
+    seen = len((page or {}).get('items', []))
+    # pageInfo.next is set even on the last page, so stop on an empty page or once totalCount items were seen
+    while page and page.get('items') and page['pageInfo'].get('next') and seen < page['pageInfo'].get('totalCount', 0):
+        page = execute(get_followers_query(profile_id, page['pageInfo']['next'])).get('followers')
+        followers += get_follower_ids(page)
+        seen += len((page or {}).get('items', []))
+    return followers
+
+def fetch_followers_batch(profile_ids):
+    if len(profile_ids) == 1:
+        pages = {profile_ids[0]: execute(get_followers_query(profile_ids[0])).get('followers')}
+    else:
+        response = execute(get_batch_followers_query(profile_ids))
+        pages = {profile_id: response.get(f"f{i}") for i, profile_id in enumerate(profile_ids)}
+    return {profile_id: fetch_all_followers(profile_id, page) for profile_id, page in pages.items()}
+
+def fetch_followers(profile_ids):
+    batches = [profile_ids[i:i + CRAWLER_FOLLOWERS_BATCH] for i in range(0, len(profile_ids), CRAWLER_FOLLOWERS_BATCH)]
+    followers = {}
+    for batch_followers in executor.map(fetch_followers_batch, batches):
+        followers.update(batch_followers)
+    return followers
+
+def write_follower_edges(followers):
+    profile_ids = [int(profile_id, base=16) for profile_id in followers]
+    existing = defaultdict(set)
+    for edge in edges_collection.find({"profile": {"$in": profile_ids}}, {"_id": 0, "profile": 1, "follower": 1}):
+        existing[edge['profile']].add(edge['follower'])
+    operations = []
+    for profile_id, follower_ids in followers.items():
+        profile = int(profile_id, base=16)
+        current = {int(follower_id, base=16) for follower_id in follower_ids}
+        operations += [InsertOne({"profile": profile, "follower": follower}) for follower in current - existing[profile]]
+        removed = existing[profile] - current
+        if removed:
+            operations.append(DeleteMany({"profile": profile, "follower": {"$in": list(removed)}}))
+    if operations:
+        try:
+            edges_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # duplicates left by an interrupted pass are already stored, anything else is a real failure
+            if any(error['code'] != 11000 for error in e.details['writeErrors']) or e.details['writeConcernErrors']:
+                raise
+    return len(operations)
+
 def add_followers_info(entries):
     print("add_followers_info called..!!")
     profiles_data = []
+    result = None
+    stored_fingerprints = get_stored_fingerprints(entries)
+    changed = []
     for entry in entries:
         profile_owned_by = entry['ownedBy']
         profile_id = entry['id']
-        # print(f"For profile_id: {profile_id}")
-        followers = []
         total_user_ids.add(profile_id)
         total_user_addresses.add(profile_owned_by)
-        follower_query = gql(get_followers_query(profile_id))
-        follower_response = client.execute(follower_query)
-        for elm in follower_response.get('followers', {}).get('items', []):
-            wallet = elm.get('wallet')
-            if wallet and wallet.get('defaultProfile'):
-                if wallet.get('defaultProfile', {}).get('id'):
-                     followers.append(wallet.get('defaultProfile', {}).get('id'))   
-        entry['followers'] = followers
-        profiles_data.append(UpdateOne({"_id": int(profile_id, base=16)},{"$set": entry}, upsert=True))
+        stored = stored_fingerprints.get(int(profile_id, base=16), {})
+        fingerprint = get_fingerprint(entry)
+        if stored.get('_fingerprint') == fingerprint:
+            continue
+        stats_fingerprint = get_fingerprint(entry.get('stats'))
+        # the follower list is only refetched when the follower count moves, other edits just rewrite the profile fields
+        followers_changed = (stored.get('stats') or {}).get('totalFollowers') != (entry.get('stats') or {}).get('totalFollowers')
+        changed.append((entry, stored.get('_stats_fingerprint') != stats_fingerprint, followers_changed))
+        entry['_fingerprint'] = fingerprint
+        entry['_stats_fingerprint'] = stats_fingerprint
+    followers = fetch_followers([entry['id'] for entry, _, followers_changed in changed if followers_changed])
+    for entry, _, _ in changed:
+        update = {"$set": entry}
+        if not EMBED_FOLLOWER_IDS:
+            # opted out, drops lists embedded by earlier crawls
+            update["$unset"] = {"followers": ""}
+        elif entry['id'] in followers:
+            entry['followers'] = followers[entry['id']]
+        profiles_data.append(UpdateOne({"_id": int(entry['id'], base=16)}, update, upsert=True))
+    pass_stats.update(profiles=len(entries), followers_fetched=len(followers), written=len(profiles_data))
+    if followers:
+        pass_stats.update(edge_writes=write_follower_edges(followers))
     if profiles_data:
         result = collection.bulk_write(profiles_data, ordered=False)
+    if CRAWLER_SUGGEST and changed:
+        pass_stats.update(suggestions=write_profile_suggestions([entry for entry, _, _ in changed]))
+    if CRAWLER_STATS_SYNC:
+        # min_profile_follower and friends filter on these copies, other profile edits don't reach the posts
+        stats_by_profile = {entry['id']: entry['stats'] for entry, stats_changed, _ in changed if stats_changed and entry.get('stats')}
+        if stats_by_profile:
+            pass_stats.update(posts_stats_synced=sync_profile_stats(POSTS_INDEX, stats_by_profile))
     return result
 
+def write_profile_suggestions(entries):
+    actions = []
+    for entry in entries:
+        followers = (entry.get('stats') or {}).get('totalFollowers', 1)
+        if entry.get('handle'):
+            actions.append(get_suggest_action(SuggestionKind.handle, entry['handle'], followers))
+        if entry.get('name'):
+            actions.append(get_suggest_action(SuggestionKind.profile_name, entry['name'], followers))
+    indexed, _ = helpers.bulk(es, actions, raise_on_error=False)
+    return indexed
+
 term_count = 0
 
-while True:
-    user_ids = []
-    for i in range(count, count+50):
-        user_id = hex(i)
-        if len(user_id)%2!=0:
-            user_ids.append(user_id.replace("0x", "0x0"))
-            continue
-        user_ids.append(user_id)
-    entries = get_user_profiles(user_ids)
-    print(f"Number of users found {len(entries)}")
-    if len(entries)==0:
-        term_count+=1
-        if term_count == 50:
-            print("Processing complete....\n\n\n")
-            time.sleep(60)
-            count = 1
-            term_count = 0
+
+def main():
+    global count, term_count
+    response = execute("""{query: ping}""")
+
+    if response['query']=='pong':
+        print("Connection established!!!")
+
+    edges_collection.create_index([("profile", 1), ("follower", 1)], unique=True)
+    edges_collection.create_index("follower")
+    if CRAWLER_SUGGEST or CRAWLER_STATS_SYNC:
+        es.init_app()
+
+    checkpoint = load_checkpoint()
+    count = checkpoint['count']
+    pass_started = time.monotonic()
+    while True:
+        user_ids = []
+        for i in range(count, count+50):
+            user_id = hex(i)
+            if len(user_id)%2!=0:
+                user_ids.append(user_id.replace("0x", "0x0"))
+                continue
+            user_ids.append(user_id)
+        entries = get_user_profiles(user_ids)
+        print(f"Number of users found {len(entries)}")
+        if len(entries)==0:
+            # gaps below the highest profile seen so far never end a pass
+            if count > checkpoint['max_profile_id']:
+                term_count+=1
+            if term_count == CRAWLER_EMPTY_WINDOWS:
+                elapsed = time.monotonic() - pass_started
+                print(f"Processing complete, {pass_stats['profiles']} profiles in {elapsed:.0f}s "
+                      f"({pass_stats['profiles'] / elapsed:.1f} profiles/sec), followers fetched for "
+                      f"{pass_stats['followers_fetched']}, {pass_stats['written']} written, "
+                      f"{pass_stats['edge_writes']} follower edge writes, "
+                      f"{pass_stats['posts_stats_synced']} posts with synced profile stats....\n\n\n")
+                count = 1
+                term_count = 0
+                checkpoint['count'] = count
+                save_checkpoint(checkpoint)
+                time.sleep(CRAWLER_PASS_SLEEP)
+                pass_started = time.monotonic()
+                pass_stats.clear()
+                continue
+            count+=50
+            checkpoint['count'] = count
+            save_checkpoint(checkpoint)
+            time.sleep(CRAWLER_WINDOW_SLEEP)
             continue
+        term_count = 0
+        window_started = time.monotonic()
+        add_followers_info(entries)
+        print(f"Processed {len(entries)} profiles at {len(entries) / (time.monotonic() - window_started):.1f} profiles/sec")
         count+=50
-        time.sleep(1)
-        continue
-    term_count = 0
-    result = add_followers_info(entries)
-    count+=50
-    time.sleep(1)
+        checkpoint['count'] = count
+        checkpoint['max_profile_id'] = max([checkpoint['max_profile_id']] + [int(entry['id'], base=16) for entry in entries])
+        save_checkpoint(checkpoint)
+        time.sleep(CRAWLER_WINDOW_SLEEP)
+
 
+if __name__ == "__main__":
+    main()
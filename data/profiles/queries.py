@@ -1,4 +1,5 @@
-from typing import List
+import json
+from typing import List, Optional
 
 
 def get_profiles_query(user_ids: List[str]) -> str:
@@ -83,14 +84,7 @@ def get_profiles_query(user_ids: List[str]) -> str:
     """.replace('USER_IDS', str(user_ids).replace("'", '"'))
 
 
-def get_followers_query(user_id: str) -> str:
-
-    return """query Followers {
-        followers(request: {
-            profileId: "USER_ID",
-            limit: 50
-            }) {
-                items {
+FOLLOWERS_FIELDS = """items {
                     wallet {
                         address
                         defaultProfile {
@@ -98,5 +92,35 @@ def get_followers_query(user_id: str) -> str:
                             }
                         }
                     }
+                pageInfo {
+                    next
+                    totalCount
+                    }"""
+
+
+def get_followers_query(user_id: str, cursor: Optional[str] = None) -> str:
+    # pageInfo.next cursors are opaque strings, json.dumps quotes them as a GraphQL string literal
+    cursor_arg = f"cursor: {json.dumps(cursor)}," if cursor else ""
+
+    return """query Followers {
+        followers(request: {
+            profileId: "USER_ID",
+            CURSOR_ARG
+            limit: 50
+            }) {
+                FOLLOWERS_FIELDS
                 }
-        }""".replace('USER_ID', user_id)
\ No newline at end of file
+        }""".replace('FOLLOWERS_FIELDS', FOLLOWERS_FIELDS).replace('USER_ID', user_id).replace('CURSOR_ARG', cursor_arg)
+
+
+def get_batch_followers_query(user_ids: List[str]) -> str:
+    # one aliased `followers` field per profile, results come back under f0, f1, ...
+    fields = "\n".join(f"""
+        f{i}: followers(request: {{
+            profileId: "{user_id}",
+            limit: 50
+            }}) {{
+                {FOLLOWERS_FIELDS}
+                }}""" for i, user_id in enumerate(user_ids))
+    return f"""query Followers {{{fields}
+        }}"""
@@ -1,18 +1,62 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 import os
 from elasticsearch.connection.http_urllib3 import create_ssl_context
 import ssl
 
+from services.timing import span
+
 CONFIG_MODE = os.environ.get('CONFIG_MODE', 'Development')
-ELASTICSEARCH_HOST = f"{os.environ.get('ES_HTTP_SERVICE_HOST','localhost')}:{int(os.environ.get('ES_HTTP_SERVICE_PORT',9200))}"    
-            
+ELASTICSEARCH_HOST = f"{os.environ.get('ES_HTTP_SERVICE_HOST','localhost')}:{int(os.environ.get('ES_HTTP_SERVICE_PORT',9200))}"
+ELASTICSEARCH_SCHEME = os.environ.get('ES_HTTP_SERVICE_SCHEME', 'https')
+ES_ASYNC_POOL_MAXSIZE = int(os.environ.get('ES_ASYNC_POOL_MAXSIZE', 50))
+
+
+def get_client_config():
+    hosts = [ ELASTICSEARCH_HOST]
+    context = create_ssl_context(cadata=os.environ.get('ES_CA'))
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_REQUIRED if CONFIG_MODE=='Production' else ssl.CERT_NONE
+    context.verify_mode = ssl.CERT_NONE
+    config = dict(hosts=hosts, api_key=("xxxxx_api_id", "xxxxx_api_key"), scheme=ELASTICSEARCH_SCHEME, timeout=360)
+    if ELASTICSEARCH_SCHEME == 'https':
+        config['ssl_context'] = context
+    return config
+
+
 class ElasticClient(Elasticsearch):
     def init_app(self):
-        hosts = [ ELASTICSEARCH_HOST]
-        context = create_ssl_context(cadata=os.environ.get('ES_CA'))
-        context.check_hostname = False        
-        context.verify_mode = ssl.CERT_REQUIRED if CONFIG_MODE=='Production' else ssl.CERT_NONE
-        context.verify_mode = ssl.CERT_NONE
-        super().__init__(hosts=hosts, api_key=("xxxxx_api_id", "xxxxx_api_key"), ssl_context=context, scheme='https', timeout=360)
-
-es = ElasticClient()
\ No newline at end of file
+        super().__init__(**get_client_config())
+
+    # the round trip includes the client's own queueing and decoding, `took` is the time spent inside ES
+    def search(self, *args, **kwargs):
+        with span("es_search") as fields:
+            res = super().search(*args, **kwargs)
+            fields["took"] = res.get("took")
+        return res
+
+    def msearch(self, *args, **kwargs):
+        with span("es_msearch") as fields:
+            res = super().msearch(*args, **kwargs)
+            fields["took"] = res.get("took")
+        return res
+
+
+class AsyncElasticClient(AsyncElasticsearch):
+    def init_app(self):
+        # aiohttp keeps its own pool, sized independently of the sync client
+        super().__init__(**get_client_config(), maxsize=ES_ASYNC_POOL_MAXSIZE)
+
+    async def search(self, *args, **kwargs):
+        with span("es_search") as fields:
+            res = await super().search(*args, **kwargs)
+            fields["took"] = res.get("took")
+        return res
+
+    async def msearch(self, *args, **kwargs):
+        with span("es_msearch") as fields:
+            res = await super().msearch(*args, **kwargs)
+            fields["took"] = res.get("took")
+        return res
+
+es = ElasticClient()
+async_es = AsyncElasticClient()
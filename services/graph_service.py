@@ -0,0 +1,66 @@
+import os
+from enum import Enum
+
+from starlette.concurrency import run_in_threadpool
+
+PROFILES_GRAPH = os.getenv("PROFILES_GRAPH", "profiles-graph")
+PROFILES_COLLECTION = os.getenv("PROFILES_COLLECTION", "profiles")
+TRAVERSE_MAX_DEPTH = int(os.getenv("TRAVERSE_MAX_DEPTH", 3))
+TRAVERSE_MAX_VERTICES = int(os.getenv("TRAVERSE_MAX_VERTICES", 1000))
+TRAVERSE_MAX_RUNTIME = float(os.getenv("TRAVERSE_MAX_RUNTIME", 5))
+TRAVERSE_VERTEX_FIELDS = os.getenv("TRAVERSE_VERTEX_FIELDS", "_id,_key,id,handle,name,ownedBy").split(",")
+TRAVERSE_EDGE_FIELDS = os.getenv("TRAVERSE_EDGE_FIELDS", "_id,_key,_from,_to").split(",")
+
+
+class DirectionEnum(str, Enum):
+    any = "any"
+    inbound = "inbound"
+    outbound = "outbound"
+
+
+def get_traversal_query(direction: DirectionEnum) -> str:
+    # the direction is a keyword and can't be a bind variable, the enum keeps it to the three valid values
+    # same {vertices, paths} shape as python-arango's graph.traverse, with the start vertex and its empty path first
+    return f"""
+    FOR start IN [DOCUMENT(@start)]
+        FILTER start != null
+        LET start_vertex = KEEP(start, @fields)
+        LET paths = (
+            FOR v, e, p IN 1..@max_depth {DirectionEnum(direction).value.upper()} start GRAPH @graph
+                OPTIONS {{bfs: true, uniqueVertices: "global"}}
+                LIMIT @limit
+                RETURN {{
+                    edges: p.edges[* RETURN KEEP(CURRENT, @edge_fields)],
+                    vertices: p.vertices[* RETURN KEEP(CURRENT, @fields)]
+                }}
+        )
+        RETURN {{
+            vertices: APPEND([start_vertex], paths[* RETURN LAST(CURRENT.vertices)]),
+            paths: APPEND([{{edges: [], vertices: [start_vertex]}}], paths)
+        }}
+    """
+
+
+def get_traversal_bind_vars(start: str, max_depth: int, limit: int) -> dict:
+    return {
+        "start": f"{PROFILES_COLLECTION}/{start}",
+        "max_depth": min(max(max_depth, 1), TRAVERSE_MAX_DEPTH),
+        "limit": min(max(limit, 1), TRAVERSE_MAX_VERTICES),
+        "graph": PROFILES_GRAPH,
+        "fields": TRAVERSE_VERTEX_FIELDS,
+        "edge_fields": TRAVERSE_EDGE_FIELDS,
+    }
+
+
+def get_traversal(graph_db, start: str, max_depth: int = 2, direction: DirectionEnum = DirectionEnum.any,
+                  limit: int = TRAVERSE_MAX_VERTICES):
+    cursor = graph_db.aql.execute(get_traversal_query(direction), bind_vars=get_traversal_bind_vars(start, max_depth, limit),
+                                  max_runtime=TRAVERSE_MAX_RUNTIME)
+    # global vertex uniqueness gives one path per reached vertex, so `limit` bounds the paths, each at most max_depth edges long
+    return next(cursor, None)
+
+
+async def async_get_traversal(graph_db, start: str, max_depth: int = 2, direction: DirectionEnum = DirectionEnum.any,
+                              limit: int = TRAVERSE_MAX_VERTICES):
+    # python-arango is requests based, run it off the event loop
+    return await run_in_threadpool(get_traversal, graph_db, start, max_depth, direction, limit)
@@ -0,0 +1,51 @@
+import os
+from datetime import date, datetime, timedelta
+from enum import Enum
+
+MAX_ROUTED_INDICES = int(os.getenv("MAX_ROUTED_INDICES", 24))
+
+
+class IndexPartitioning(str, Enum):
+    none = "none"
+    monthly = "monthly"
+    weekly = "weekly"
+
+
+def to_date(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+class IndexRouting:
+    """Maps a time window onto the time-partitioned indices behind an alias.
+
+    Partitions are named by ``pattern`` with ``{period}`` as ``YYYY.MM`` (monthly) or ``YYYY.wWW``
+    (ISO weeks). Windows without a lower bound, or spanning more than MAX_ROUTED_INDICES partitions,
+    fall back to the alias.
+    """
+
+    def __init__(self, alias: str, pattern: str, partitioning: IndexPartitioning = IndexPartitioning.none):
+        self.alias = alias
+        self.pattern = pattern
+        self.partitioning = partitioning
+
+    def get_periods(self, from_date: date, to_date: date):
+        if self.partitioning == IndexPartitioning.monthly:
+            year, month = from_date.year, from_date.month
+            while (year, month) <= (to_date.year, to_date.month):
+                yield f"{year:04d}.{month:02d}"
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        elif self.partitioning == IndexPartitioning.weekly:
+            day = from_date - timedelta(days=from_date.weekday())
+            while day <= to_date:
+                iso_year, iso_week, _ = day.isocalendar()
+                yield f"{iso_year:04d}.w{iso_week:02d}"
+                day += timedelta(weeks=1)
+
+    def get_index(self, from_date=None, until_date=None) -> str:
+        if self.partitioning == IndexPartitioning.none or not from_date:
+            return self.alias
+        periods = list(self.get_periods(to_date(from_date), to_date(until_date or datetime.now())))
+        if not periods or len(periods) > MAX_ROUTED_INDICES:
+            return self.alias
+        # wildcards keep windows that reach partitions not created yet from failing the search
+        return ",".join(f"{self.pattern.format(period=period)}*" for period in periods)
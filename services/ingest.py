@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+
+from elasticsearch.helpers import async_streaming_bulk
+
+from services import metrics
+from services.lens_service import INDEX, add_ingested_date
+from services.suggest import async_index_hashtag_suggestions
+
+logger = logging.getLogger(__name__)
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 20000))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", 1000))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 1.0))
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", 5.0))
+INGEST_BATCH_RETENTION = int(os.getenv("INGEST_BATCH_RETENTION", 1000))
+INGEST_MAX_ERRORS_PER_BATCH = int(os.getenv("INGEST_MAX_ERRORS_PER_BATCH", 100))
+# a line is buffered whole before it is parsed, so this bounds the memory one request can hold
+INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", 1024 * 1024))
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestLineTooLong(Exception):
+    pass
+
+
+async def iter_ndjson_lines(chunks, max_line_bytes: int = INGEST_MAX_LINE_BYTES):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > max_line_bytes:
+                raise IngestLineTooLong(f"Line longer than {max_line_bytes} bytes")
+            if line.strip():
+                yield line
+        if len(buffer) > max_line_bytes:
+            raise IngestLineTooLong(f"Line longer than {max_line_bytes} bytes")
+    if buffer.strip():
+        yield buffer
+
+
+class IngestBatch:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.created_at = datetime.now().isoformat()
+        self.accepted = 0
+        self.indexed = 0
+        self.failed = 0
+        self.closed = False
+        self.errors = []
+
+    def add_error(self, position, error):
+        self.failed += 1
+        if len(self.errors) < INGEST_MAX_ERRORS_PER_BATCH:
+            self.errors.append({"position": position, "error": error})
+
+    @property
+    def status(self):
+        if not self.closed:
+            return "receiving"
+        return "done" if self.indexed + self.failed >= self.accepted else "indexing"
+
+    def dict(self):
+        return {
+            "batch_id": self.id, "status": self.status, "created_at": self.created_at, "accepted": self.accepted,
+            "indexed": self.indexed, "failed": self.failed, "errors": self.errors
+        }
+
+
+class IngestPipeline:
+    """Bounded in-process queue of documents flushed to ES by background bulk workers.
+
+    A flush happens once ``flush_size`` documents are collected or ``flush_interval`` seconds after the
+    first one arrived, whichever comes first. ``put`` blocks while the queue is full and raises
+    IngestQueueFull after ``enqueue_timeout`` so callers can push back on their clients.
+    """
+
+    def __init__(self, es_client, index: str = INDEX, queue_size: int = INGEST_QUEUE_SIZE, workers: int = INGEST_WORKERS,
+                 flush_size: int = INGEST_FLUSH_SIZE, flush_interval: float = INGEST_FLUSH_INTERVAL,
+                 enqueue_timeout: float = INGEST_ENQUEUE_TIMEOUT):
+        self.es_client = es_client
+        self.index = index
+        self.queue_size = queue_size
+        self.workers = workers
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.batches = OrderedDict()
+        self.queue = None
+        self._tasks = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.ensure_future(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # the sentinels queue up behind pending documents, so everything accepted is flushed first
+        for _ in self._tasks:
+            await self.queue.put(None)
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+    async def join(self):
+        await self.queue.join()
+
+    def create_batch(self) -> IngestBatch:
+        batch = IngestBatch()
+        self.batches[batch.id] = batch
+        while len(self.batches) > INGEST_BATCH_RETENTION:
+            self.batches.popitem(last=False)
+        return batch
+
+    def get_batch(self, batch_id: str):
+        return self.batches.get(batch_id)
+
+    async def put(self, batch: IngestBatch, content: dict):
+        try:
+            await asyncio.wait_for(self.queue.put((batch, batch.accepted, content)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("ingest_rejected_total")
+            raise IngestQueueFull(f"Ingestion queue is full ({self.queue_size} documents)")
+        batch.accepted += 1
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            items = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(items) < self.flush_size:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                items.append(item)
+            try:
+                await self.flush(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    async def flush(self, items):
+        started = time.perf_counter()
+        ingested_at = datetime.now().isoformat()
+        actions = [{
+            "_index": self.index,
+            "_id": content.get("metadata_id"),
+            "_source": add_ingested_date(content, ingested_at),
+        } for _, _, content in items]
+        # retried chunks come back out of order, so results are matched to their batch by _id
+        pending = defaultdict(deque)
+        for batch, batch_position, content in items:
+            pending[content.get("metadata_id")].append((batch, batch_position, content))
+        failed = 0
+        created = []
+        try:
+            async for ok, result in async_streaming_bulk(self.es_client, actions, chunk_size=self.flush_size, max_retries=3,
+                                                         raise_on_error=False, raise_on_exception=False):
+                op_result = next(iter(result.values()))
+                batch, batch_position, content = pending[op_result.get("_id")].popleft()
+                if ok:
+                    batch.indexed += 1
+                    if op_result.get("result") == "created":
+                        created.append(content)
+                else:
+                    failed += 1
+                    batch.add_error(batch_position, op_result.get("error"))
+        except Exception as e:
+            logger.exception("Bulk flush of %s documents failed", len(items))
+            for remaining in pending.values():
+                for batch, batch_position, _ in remaining:
+                    failed += 1
+                    batch.add_error(batch_position, str(e))
+            pending.clear()
+        metrics.incr("ingest_docs_total", len(items) - failed, result="indexed")
+        metrics.incr("ingest_docs_total", failed, result="failed")
+        metrics.incr("ingest_flushes_total")
+        metrics.incr("ingest_flush_seconds_total", time.perf_counter() - started)
+        try:
+            # only a publication's first indexing counts its hashtags, a re-sent metadata_id comes back "updated"
+            await async_index_hashtag_suggestions(created)
+        except Exception:
+            logger.exception("Hashtag suggestions of %s documents failed", len(created))
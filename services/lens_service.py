@@ -1,12 +1,28 @@
+import asyncio
+import base64
+from contextlib import contextmanager
+import copy
 from functools import reduce
+import itertools
+import json
+import logging
 import operator
 import os
+import re
+import time
 from datetime import date, datetime, timedelta
-from services.es_search import es
+from services import metrics
+from services.timing import add_span, span
+from services.es_search import es, async_es
+from services.index_routing import IndexPartitioning, IndexRouting
+from services.suggest import index_hashtag_suggestions
 from enum import Enum
 from elasticsearch import helpers
-from pydantic import BaseModel
-from typing import List, Optional
+from elasticsearch.exceptions import NotFoundError, TransportError
+from pydantic import BaseModel, conlist, constr
+from typing import List, Literal, Optional, Union
+
+logger = logging.getLogger(__name__)
 
 
 class SearchType(str, Enum):
@@ -22,11 +38,34 @@ class QueryMatchType(str, Enum):
     must = "must"
     must_not = "must_not"
     shoul_not = "shoul_not"
+    filter = "filter"
 
     def __str__(self):
         return str(self.value)
 
 
+class SuggestionRetryMode(str, Enum):
+    sequential = "sequential"
+    msearch = "msearch"
+
+
+class SuggestionStrategy(str, Enum):
+    per_field = "per_field"
+    single_field = "single_field"
+    lazy = "lazy"
+
+
+class TextQueryMode(str, Enum):
+    per_field = "per_field"
+    multi_match = "multi_match"
+
+
+class MultiMatchType(str, Enum):
+    best_fields = "best_fields"
+    cross_fields = "cross_fields"
+    most_fields = "most_fields"
+
+
 class ResultType(str, Enum):
     latest = "latest"
     links = "links"
@@ -35,6 +74,33 @@ class ResultType(str, Enum):
     top = "top"
 
 
+class TrendsWindow(str, Enum):
+    hour = "1h"
+    day = "24h"
+    two_days = "48h"
+    week = "7d"
+
+
+class ResponseView(str, Enum):
+    compact = "compact"
+    card = "card"
+    full = "full"
+
+
+class MultiSearchEndpoint(str, Enum):
+    publications = "publications"
+    profiles = "profiles"
+    nfts = "nfts"
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class ExpiredCursorError(InvalidCursorError):
+    pass
+
+
 class AttributesSchema(BaseModel):
     traitType: str
     value: int
@@ -60,31 +126,138 @@ class MetadataSchema(BaseModel):
     profileId: Optional[str]
 
 
+MULTI_SEARCH_MAX_QUERIES = int(os.getenv("MULTI_SEARCH_MAX_QUERIES", 10))
+# `fields` values: _source paths and wildcards, comma separated
+SOURCE_FIELDS_PATTERN = r"^[\w.*,\s]*$"
+SOURCE_FIELDS_MAX_LENGTH = 1024
+
+
+# sub-queries of /search/multi take the params, and defaults, of their single endpoint
+class PublicationsQuerySchema(BaseModel):
+    type: Literal["publications"]
+    text: str = ""
+    bio: Optional[str]
+    from_users: Optional[str]
+    mention_users: Optional[str]
+    search_type: SearchType = SearchType.any_words
+    result_type: ResultType = ResultType.top
+    min_collects: Optional[int]
+    min_mirror: Optional[int]
+    min_comments: Optional[int]
+    min_profile_follower: Optional[int]
+    min_profile_posts: Optional[int]
+    app_id: Optional[str]
+    from_date: Optional[date]
+    to_date: Optional[date]
+    page: int = 1
+    size: int = 10
+    cursor: Optional[str]
+    consistent: bool = False
+    view: ResponseView = ResponseView.full
+    fields: Optional[constr(regex=SOURCE_FIELDS_PATTERN, max_length=SOURCE_FIELDS_MAX_LENGTH)]
+
+
+class ProfilesQuerySchema(BaseModel):
+    type: Literal["profiles"]
+    text: str = ""
+    bio: Optional[str]
+    page: int = 1
+    size: int = 10
+    owned_by: Optional[str]
+    min_follower: Optional[int]
+    min_posts: Optional[int]
+    min_publications: Optional[int]
+    min_comments: Optional[int]
+
+
+class NftsQuerySchema(BaseModel):
+    type: Literal["nfts"]
+    text: str = ""
+    page: int = 1
+    size: int = 10
+    search_type: SearchType = SearchType.all_words
+
+
+class MultiSearchSchema(BaseModel):
+    queries: conlist(Union[PublicationsQuerySchema, ProfilesQuerySchema, NftsQuerySchema], min_items=1, max_items=MULTI_SEARCH_MAX_QUERIES)
+
+
 INDEX = os.getenv("LENS_DATA_INDEX", "lens-test-data")
 LENS_PROFILE_INDEX = os.getenv("LENS_PROFILE_INDEX", "lens-profile-csv-data")
 LENS_PROFILE_INDEX = os.getenv("LENS_PROFILE_INDEX", "lens-final-profiles-data")
-POSTS_INDEX = os.getenv("LENS_PROFILE_INDEX", "lens-final-posts-data")
+POSTS_INDEX = os.getenv("LENS_POSTS_INDEX", "lens-final-posts-data")
 NFTS_INDEX = os.getenv("LENS_NFTS_INDEX", "lens-nfts-test-data")
-
-ES_RESPONSE_FIELDS = [
-    "metadata_id",
-    "description",
-    "content",
-    "external_url",
-    "name",
-    "attributes",
-    "image",
-    "imageMimeType",
-    "media",
-    "appId",
-    "profileId",
-    "ingested_at"
-]
-
-def get_match_query(search_type, text, field):
+# time-partitioned indices behind the aliases, searched directly when a date window is given
+POSTS_INDEX_ROUTING = IndexRouting(POSTS_INDEX, os.getenv("POSTS_INDEX_PATTERN", POSTS_INDEX + "-{period}"),
+                                   IndexPartitioning(os.getenv("POSTS_INDEX_PARTITIONING", IndexPartitioning.none.value)))
+DATA_INDEX_ROUTING = IndexRouting(INDEX, os.getenv("LENS_DATA_INDEX_PATTERN", INDEX + "-{period}"),
+                                  IndexPartitioning(os.getenv("LENS_DATA_INDEX_PARTITIONING", IndexPartitioning.none.value)))
+PIT_KEEP_ALIVE = os.getenv("PIT_KEEP_ALIVE", "1m")
+# hits per search_after page of the streaming exports
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 1000))
+# makes the createdAt / _score sorts total so search_after cursors never skip or repeat hits
+CURSOR_TIEBREAKER = {os.getenv("CURSOR_TIEBREAKER_FIELD", "id.keyword"): "asc"}
+SUGGESTION_RETRY_MODE = SuggestionRetryMode(os.getenv("SUGGESTION_RETRY_MODE", SuggestionRetryMode.sequential.value))
+SUGGESTION_STRATEGY = SuggestionStrategy(os.getenv("SUGGESTION_STRATEGY", SuggestionStrategy.single_field.value))
+# one match clause per text field, or one boosted multi_match over all the fields sharing the text
+TEXT_QUERY_MODE = TextQueryMode(os.getenv("TEXT_QUERY_MODE", TextQueryMode.per_field.value))
+MULTI_MATCH_TYPE = MultiMatchType(os.getenv("MULTI_MATCH_TYPE", MultiMatchType.best_fields.value))
+MULTI_MATCH_TIE_BREAKER = float(os.getenv("MULTI_MATCH_TIE_BREAKER", 0.3))
+# multi_match boosts per searched endpoint, comma separated "field^boost" like multi_match takes them, fields not listed keep 1
+TEXT_QUERY_FIELD_BOOSTS = {
+    endpoint: dict(item.strip().split("^", 1) for item in boosts.split(",") if "^" in item)
+    for endpoint, boosts in {
+        MultiSearchEndpoint.publications: os.getenv("POSTS_FIELD_BOOSTS", "metadata.content^3,metadata.name^2,profile.handle^2,profile.name^2"),
+        MultiSearchEndpoint.profiles: os.getenv("PROFILES_FIELD_BOOSTS", "handle^3,name^2"),
+        MultiSearchEndpoint.nfts: os.getenv("NFTS_FIELD_BOOSTS", "name^2,collectionName^2,contractName^2,symbol^2"),
+    }.items()
+}
+# async_search() bodies are rendered from a pre-serialized skeleton per query shape instead of being built and encoded per request
+QUERY_TEMPLATES_ENABLED = os.getenv("QUERY_TEMPLATES_ENABLED", "true").lower() == "true"
+QUERY_TEMPLATE_CACHE_SIZE = int(os.getenv("QUERY_TEMPLATE_CACHE_SIZE", 1024))
+QUERY_TEMPLATE_SLOT = re.compile(r'"@@(\d+)@@"|@@(\d+)@@')
+# the same encoding elasticsearch-py's JSONSerializer produces
+QUERY_TEMPLATE_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+# single field the single_field and lazy strategies run their term suggester over, per searched endpoint
+SUGGESTION_FIELDS = {
+    MultiSearchEndpoint.publications: os.getenv("POSTS_SUGGESTION_FIELD", "metadata.content"),
+    MultiSearchEndpoint.profiles: os.getenv("PROFILES_SUGGESTION_FIELD", "handle"),
+    MultiSearchEndpoint.nfts: os.getenv("NFTS_SUGGESTION_FIELD", "name")
+}
+# significant_text re-analyzes _source, so each shard only feeds it this many of the window's docs
+TRENDS_SAMPLER_SHARD_SIZE = int(os.getenv("TRENDS_SAMPLER_SHARD_SIZE", 500))
+# share of the window after which a post's sampling score has halved
+TRENDS_DECAY_SCALE = float(os.getenv("TRENDS_DECAY_SCALE", 0.25))
+TRENDS_WINDOWS = {
+    TrendsWindow.hour: timedelta(hours=1),
+    TrendsWindow.day: timedelta(days=1),
+    TrendsWindow.two_days: timedelta(days=2),
+    TrendsWindow.week: timedelta(days=7),
+}
+
+# `_source` includes per view, `full` returns the whole document
+PUBLICATION_VIEW_FIELDS = {
+    ResponseView.compact: ["id", "createdAt", "appId", "metadata.content", "profile.id", "profile.handle"],
+    ResponseView.card: ["id", "createdAt", "appId", "metadata.content", "metadata.name", "metadata.description", "metadata.media",
+                        "profile.id", "profile.handle", "profile.name", "profile.picture", "stats"],
+}
+COMMENT_VIEW_FIELDS = {view: fields + ["mainPost.id"] for view, fields in PUBLICATION_VIEW_FIELDS.items()}
+
+
+def get_source_includes(view_fields: dict, view: ResponseView = ResponseView.full, fields: str = None):
+    # explicit comma separated `fields` win over the view
+    includes = [field.strip() for field in (fields or "").split(",") if field.strip()]
+    return includes or view_fields.get(view)
+
+def get_match_text(search_type, text):
     if search_type == SearchType.hashtags:
         text = " ".join(
             hashtag if "#" in hashtag else f"#{hashtag}" for hashtag in text.split(" "))
+    return text
+
+
+def get_match_query(search_type, text, field):
+    text = get_match_text(search_type, text)
     res = {"match": {field: {"query": text}}}
     if search_type == SearchType.exact_phrase:
         res = {"match_phrase": {field: {"query": text}}}
@@ -92,40 +265,91 @@ def get_match_query(search_type, text, field):
         res = {"match": {field: {"query": text, "operator": "and"}}}
     return res
 
-def get_publication_comments(pub_id: str, page: int = 1, size: int = 10):
+
+def get_multi_match_query(search_type, text, fields, field_boosts: dict = {}):
+    if len(fields) == 1:
+        return get_match_query(search_type, text, fields[0])
+    res = {
+        "query": get_match_text(search_type, text),
+        "fields": [f"{field}^{field_boosts[field]}" if field in field_boosts else field for field in fields],
+        "type": MULTI_MATCH_TYPE.value,
+        "tie_breaker": MULTI_MATCH_TIE_BREAKER
+    }
+    if search_type == SearchType.exact_phrase:
+        res["type"] = "phrase"
+    if search_type == SearchType.all_words:
+        res["operator"] = "and"
+    return {"multi_match": res}
+
+PUBLICATION_SHOULD_QUERY_FIELDS = ["metadata.content", "metadata.description", "metadata.name", "profile.name", "profile.id",
+                                   "profile.bio", "profile.location", "profile.handle", "profile.twitterUrl", "profile.ownedBy"]
+PROFILE_SHOULD_QUERY_FIELDS = ["name", "bio", "location", "handle", "twitterUrl"]
+NFT_TEXT_QUERY_FIELDS = ["contractName", "contractAddress", "symbol", "tokenId", "owners.address", "ercType",
+                         "name", "description", "contentURI", "originalContent.uri", "collectionName"]
+# fields the "did you mean" rewrite is allowed to touch, mirroring what the sequential retry replaces
+PUBLICATION_FUZZY_FIELDS = set(PUBLICATION_SHOULD_QUERY_FIELDS + ["profile.bio"])
+PROFILE_FUZZY_FIELDS = set(PROFILE_SHOULD_QUERY_FIELDS)
+NFT_FUZZY_FIELDS = set(NFT_TEXT_QUERY_FIELDS)
+
+
+def get_publication_comments_query(pub_id: str, page: int = 1, size: int = 10, source_includes: list = None):
     query = {
         "query": {
-            "bool": {"must": [
-                {"match": {"mainPost.id.keyword": pub_id}}
+            "bool": {"filter": [
+                {"term": {"mainPost.id.keyword": pub_id}}
             ]}
         },
+        "sort": [{"createdAt": "desc"}, CURSOR_TIEBREAKER],
         "size": size,
         "from": (page - 1 if page > 0 else 0) * size
     }
-    res = es.search(index=POSTS_INDEX, body=query)
+    if source_includes:
+        query["_source"] = source_includes
+    return query
+
+
+def get_publication_comments_response(res, page: int, next_cursor: str = None):
     data = list(map(lambda x: x["_source"], res["hits"]["hits"]))
-    return {"page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data}
+    return {"page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data, "next_cursor": next_cursor}
+
+
+async def async_get_publication_comments(pub_id: str, page: int = 1, size: int = 10, cursor: str = None, consistent: bool = False,
+                                         view: ResponseView = ResponseView.full, fields: str = None):
+    search_after, pit_id = await async_get_cursor_args(POSTS_INDEX, cursor, consistent)
+    with span("query_build"):
+        query = get_publication_comments_query(pub_id, page, size, get_source_includes(COMMENT_VIEW_FIELDS, view, fields))
+    with expired_cursor_check(pit_id):
+        res = await async_es.search(**get_search_request(POSTS_INDEX, query, search_after, pit_id))
+    next_cursor = get_next_cursor(res, size, pit_id)
+    await async_close_exhausted_cursor(res, pit_id, next_cursor)
+    return get_publication_comments_response(res, page, next_cursor)
+
+
+def async_export_publication_comments(pub_id: str, view: ResponseView = ResponseView.full, fields: str = None):
+    query = get_publication_comments_query(pub_id, size=EXPORT_PAGE_SIZE,
+                                           source_includes=get_source_includes(COMMENT_VIEW_FIELDS, view, fields))
+    return async_iter_search_export(POSTS_INDEX, query)
 
 
-def search_publications(text="", bio: str = None, from_users: str = None, mention_users: str = None, search_type=SearchType.any_words,
-                        result_type: ResultType = ResultType.latest, min_collects: int = None,  min_mirror: int = None, min_comments: int = None,
-                        min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None, from_date: date = None,
-                        to_date: date = None, page: int = 1, size: int = 10, retrying: bool = False):
+def get_publications_search_args(text="", bio: str = None, from_users: str = None, mention_users: str = None, search_type=SearchType.any_words,
+                                 result_type: ResultType = ResultType.latest, min_collects: int = None,  min_mirror: int = None, min_comments: int = None,
+                                 min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None,
+                                 from_date: date = None, to_date: date = None, view: ResponseView = ResponseView.full, fields: str = None):
 
     results_map = {"links": {"metadata.content": "http https"}, "photo": {
         "metadata.media.original.mimeType": "image"}, "video": {"metadata.media.original.mimeType": "video"}}
     result_type_info = results_map.get(
         result_type.value, {}) if result_type else {}
     must_query_field_values = {
-        "appId": app_id,
-        "profile.handle": from_users,
         "profile.bio": bio,
         "metadata.description": mention_users
     }
+    term_field_values = {
+        "appId": app_id,
+        "profile.handle": from_users
+    }
 
-    should_query_fields = set(["metadata.content", "metadata.description", "metadata.name", "profile.name", "profile.id",
-                               "profile.bio", "profile.location", "profile.handle", "profile.twitterUrl", "profile.ownedBy"])
-    should_query_field_values = {field: text for field in should_query_fields}
+    should_query_field_values = {field: text for field in PUBLICATION_SHOULD_QUERY_FIELDS}
 
     gte_range_query_field_values = {
         "stats.totalAmountOfMirrors": min_mirror,
@@ -134,36 +358,51 @@ def search_publications(text="", bio: str = None, from_users: str = None, mentio
         "profile.stats.totalFollowers": min_profile_follower,
         "profile.stats.totalPosts": min_profile_posts
     }
-    sort_by = {"createdAt": "desc"} if result_type != ResultType.top else None
-    res = search(POSTS_INDEX, must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values,
-                 prefix_field_values=result_type_info, page=page, size=size, sort_by=sort_by)
+    date_range_field_values = {
+        "createdAt": (from_date, to_date)
+    }
+    sort_by = [{"createdAt": "desc"} if result_type != ResultType.top else {"_score": "desc"}, CURSOR_TIEBREAKER]
+    return {
+        "must_query_field_values": must_query_field_values,
+        "should_query_field_values": should_query_field_values,
+        "search_type": search_type,
+        "gte_range_query_field_values": gte_range_query_field_values,
+        "prefix_field_values": result_type_info,
+        "term_field_values": term_field_values,
+        "date_range_field_values": date_range_field_values,
+        "sort_by": sort_by,
+        "source_includes": get_source_includes(PUBLICATION_VIEW_FIELDS, view, fields),
+        "field_boosts": TEXT_QUERY_FIELD_BOOSTS[MultiSearchEndpoint.publications],
+        "suggestion_field": SUGGESTION_FIELDS[MultiSearchEndpoint.publications]
+    }
 
-    if len(res["hits"]["hits"]) == 0 and not retrying:
-        suggestion_res = get_search_suggestion(res, False)
-        bio = suggestion_res.get("profile.bio", [bio])[0] if bio else None
-        # from_users = suggestion_res.get("profile.handle", from_users)[
-        #     0] if from_users else None
-        # do not consider suggestion for must fields (handle and bio) again in should fields
-        if bio:
-            suggestion_res.pop("profile.bio", None)
-        if from_users:
-            suggestion_res.pop("profile.handle", None)
-        should_suggestions = [suggestion_res.get(
-            field) for field in should_query_fields if field in suggestion_res]
-        should_suggestions = list(
-            reduce(operator.concat, should_suggestions, []))
-        suggestion = should_suggestions[0] if should_suggestions else ""
-        if SearchType.any_words == search_type:
-            suggestion = " ".join(should_suggestions)
-        if suggestion:
-            text = suggestion
-        return search_publications(text, bio, from_users, mention_users, search_type, result_type, min_collects,
-                                   min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id,
-                                   from_date, to_date, page, size, retrying=True)
 
+def get_publications_suggestion(res, text, bio, from_users, search_type):
+    suggestion_res = get_search_suggestion(res, False)
+    bio = suggestion_res.get("profile.bio", [bio])[0] if bio else None
+    # from_users = suggestion_res.get("profile.handle", from_users)[
+    #     0] if from_users else None
+    # do not consider suggestion for must fields (handle and bio) again in should fields
+    if bio:
+        suggestion_res.pop("profile.bio", None)
+    if from_users:
+        suggestion_res.pop("profile.handle", None)
+    should_suggestions = [suggestion_res.get(
+        field) for field in PUBLICATION_SHOULD_QUERY_FIELDS if field in suggestion_res]
+    should_suggestions = list(
+        reduce(operator.concat, should_suggestions, []))
+    suggestion = should_suggestions[0] if should_suggestions else ""
+    if SearchType.any_words == search_type:
+        suggestion = " ".join(should_suggestions)
+    if suggestion:
+        text = suggestion
+    return text, bio
+
+
+def get_publications_response(res, text, min_collects, min_comments, min_mirror, page, next_cursor: str = None):
     data = list(map(lambda x: x["_source"], res["hits"]["hits"]))
     return {
-        "page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data,
+        "page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data, "next_cursor": next_cursor,
         "query": {
             "text": text,
             "min_collects": min_collects,
@@ -172,16 +411,70 @@ def search_publications(text="", bio: str = None, from_users: str = None, mentio
         }}
 
 
-def search_profiles(text: str, bio: str, owned_by: str, min_follower: int, min_posts: int, min_publications: int, min_comments: int,
-                    page: int = 1, size: int = 10, retrying=False):
+async def async_search_publications(text="", bio: str = None, from_users: str = None, mention_users: str = None, search_type=SearchType.any_words,
+                                    result_type: ResultType = ResultType.latest, min_collects: int = None,  min_mirror: int = None, min_comments: int = None,
+                                    min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None, from_date: date = None,
+                                    to_date: date = None, page: int = 1, size: int = 10, cursor: str = None, consistent: bool = False,
+                                    view: ResponseView = ResponseView.full, fields: str = None, retrying: bool = False):
+    search_args = get_publications_search_args(text, bio, from_users, mention_users, search_type, result_type, min_collects,
+                                               min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id,
+                                               from_date, to_date, view, fields)
+    es_index = POSTS_INDEX_ROUTING.get_index(from_date, to_date)
+    search_after, pit_id = await async_get_cursor_args(es_index, cursor, consistent)
+    if SUGGESTION_RETRY_MODE == SuggestionRetryMode.msearch and not retrying and not (search_after or pit_id):
+        res, fallback_res, suggest_res = await async_search_with_suggestion_fallback(
+            "publications", POSTS_INDEX, get_search_query(**search_args, page=page, size=size), PUBLICATION_FUZZY_FIELDS, text,
+            routed_index=es_index)
+        if fallback_res:
+            text, _ = get_publications_suggestion(suggest_res, text, bio, from_users, search_type)
+            res = fallback_res
+        return get_publications_response(res, text, min_collects, min_comments, min_mirror, page, get_next_cursor(res, size))
+
+    res = await async_search(es_index, **search_args, page=page, size=size, search_after=search_after, pit_id=pit_id)
+
+    if len(res["hits"]["hits"]) == 0 and not retrying and not search_after:
+        started = time.perf_counter()
+        suggest_res = await async_get_suggestion_response(MultiSearchEndpoint.publications, POSTS_INDEX, res, text)
+        suggested_text, suggested_bio = get_publications_suggestion(suggest_res, text, bio, from_users, search_type)
+        # an unchanged query would come back empty again
+        if (suggested_text, suggested_bio) == (text, bio):
+            await async_close_exhausted_cursor(res, pit_id)
+            return get_publications_response(res, text, min_collects, min_comments, min_mirror, page)
+        text, bio = suggested_text, suggested_bio
+        retry_res = await async_search_publications(text, bio, from_users, mention_users, search_type, result_type, min_collects,
+                                                    min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id,
+                                                    from_date, to_date, page, size, encode_cursor(None, pit_id) if pit_id else None,
+                                                    view=view, fields=fields, retrying=True)
+        record_suggestion_retry("publications", time.perf_counter() - started)
+        return retry_res
+
+    next_cursor = get_next_cursor(res, size, pit_id)
+    await async_close_exhausted_cursor(res, pit_id, next_cursor)
+    return get_publications_response(res, text, min_collects, min_comments, min_mirror, page, next_cursor)
+
+
+def async_export_publications(text="", bio: str = None, from_users: str = None, mention_users: str = None, search_type=SearchType.any_words,
+                              result_type: ResultType = ResultType.latest, min_collects: int = None,  min_mirror: int = None, min_comments: int = None,
+                              min_profile_follower: int = None, min_profile_posts: int = None, app_id: str = None, from_date: date = None,
+                              to_date: date = None, view: ResponseView = ResponseView.full, fields: str = None):
+    search_args = get_publications_search_args(text, bio, from_users, mention_users, search_type, result_type, min_collects,
+                                               min_mirror, min_comments, min_profile_follower, min_profile_posts, app_id,
+                                               from_date, to_date, view, fields)
+    # no suggestions, an export never retries with a corrected text
+    query = get_search_query(**search_args, size=EXPORT_PAGE_SIZE, suggestion_strategy=SuggestionStrategy.lazy)
+    return async_iter_search_export(POSTS_INDEX_ROUTING.get_index(from_date, to_date), query)
+
+
+def get_profiles_search_args(text: str, bio: str, owned_by: str, min_follower: int, min_posts: int, min_publications: int, min_comments: int):
 
     must_query_field_values = {
-        "ownedBy": owned_by,
         "bio": bio
     }
+    term_field_values = {
+        "ownedBy": owned_by
+    }
 
-    should_query_fields = ["name", "bio", "location", "handle", "twitterUrl"]
-    should_query_field_values = {field: text for field in should_query_fields}
+    should_query_field_values = {field: text for field in PROFILE_SHOULD_QUERY_FIELDS}
 
     gte_range_query_field_values = {
         "stats.totalFollowers": min_follower,
@@ -189,19 +482,29 @@ def search_profiles(text: str, bio: str, owned_by: str, min_follower: int, min_p
         "stats.totalComments": min_comments,
         "stats.totalPosts": min_posts
     }
-    res = search(LENS_PROFILE_INDEX, must_query_field_values, should_query_field_values,
-                 SearchType.any_words, gte_range_query_field_values, page=page, size=size)
+    return {
+        "must_query_field_values": must_query_field_values,
+        "should_query_field_values": should_query_field_values,
+        "search_type": SearchType.any_words,
+        "gte_range_query_field_values": gte_range_query_field_values,
+        "term_field_values": term_field_values,
+        "field_boosts": TEXT_QUERY_FIELD_BOOSTS[MultiSearchEndpoint.profiles],
+        "suggestion_field": SUGGESTION_FIELDS[MultiSearchEndpoint.profiles]
+    }
 
-    if len(res["hits"]["hits"]) == 0 and not retrying:
-        suggestion_res = get_search_suggestion(res)
-        bio = suggestion_res.get("bio", bio) if bio else None
-        if bio:
-            suggestion_res.pop("bio", None)
-        suggestion = " ".join(suggestion_res.values())
-        if suggestion:
-            text = suggestion
-        return search_profiles(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments, page, size, retrying=True)
 
+def get_profiles_suggestion(res, text, bio):
+    suggestion_res = get_search_suggestion(res)
+    bio = suggestion_res.get("bio", bio) if bio else None
+    if bio:
+        suggestion_res.pop("bio", None)
+    suggestion = " ".join(suggestion_res.values())
+    if suggestion:
+        text = suggestion
+    return text, bio
+
+
+def get_profiles_response(res, text, owned_by, min_follower, min_posts, min_publications, min_comments, page):
     data = list(map(lambda x: x["_source"], res["hits"]["hits"]))
     return {
         "page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data,
@@ -215,7 +518,35 @@ def search_profiles(text: str, bio: str, owned_by: str, min_follower: int, min_p
         }}
 
 
-def search_nfts(text="", search_type=SearchType.any_words, page: int = 1, size: int = 10, retrying: bool = False):
+async def async_search_profiles(text: str, bio: str, owned_by: str, min_follower: int, min_posts: int, min_publications: int, min_comments: int,
+                                page: int = 1, size: int = 10, retrying=False):
+    search_args = get_profiles_search_args(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments)
+    if SUGGESTION_RETRY_MODE == SuggestionRetryMode.msearch and not retrying:
+        res, fallback_res, suggest_res = await async_search_with_suggestion_fallback(
+            "profiles", LENS_PROFILE_INDEX, get_search_query(**search_args, page=page, size=size), PROFILE_FUZZY_FIELDS, text)
+        if fallback_res:
+            text, _ = get_profiles_suggestion(suggest_res, text, bio)
+            res = fallback_res
+        return get_profiles_response(res, text, owned_by, min_follower, min_posts, min_publications, min_comments, page)
+
+    res = await async_search(LENS_PROFILE_INDEX, **search_args, page=page, size=size)
+
+    if len(res["hits"]["hits"]) == 0 and not retrying:
+        started = time.perf_counter()
+        suggest_res = await async_get_suggestion_response(MultiSearchEndpoint.profiles, LENS_PROFILE_INDEX, res, text)
+        suggested_text, suggested_bio = get_profiles_suggestion(suggest_res, text, bio)
+        if (suggested_text, suggested_bio) == (text, bio):
+            return get_profiles_response(res, text, owned_by, min_follower, min_posts, min_publications, min_comments, page)
+        text, bio = suggested_text, suggested_bio
+        retry_res = await async_search_profiles(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments, page, size, retrying=True)
+        record_suggestion_retry("profiles", time.perf_counter() - started)
+        return retry_res
+
+    return get_profiles_response(res, text, owned_by, min_follower, min_posts, min_publications, min_comments, page)
+
+
+def get_nfts_query(text="", search_type=SearchType.any_words, page: int = 1, size: int = 10,
+                   suggestion_strategy: SuggestionStrategy = None, text_query_mode: TextQueryMode = None):
 
     query = {
         "query": {
@@ -226,27 +557,31 @@ def search_nfts(text="", search_type=SearchType.any_words, page: int = 1, size:
             }
         },
         "size": size,
-        "from": (page - 1 if page > 0 else 0) * size
+        "from": (page - 1 if page > 0 else 0) * size,
+        "suggest": {}
     }
 
     if text:
-        text_query_fields = ["contractName", "contractAddress", "symbol", "tokenId", "owners.address", "ercType",
-                             "name", "description", "contentURI", "originalContent.uri", "collectionName"]
-        query_field_values = [(field, text) for field in text_query_fields]
-        add_match_query_multi(query_field_values, query,
-                              QueryMatchType.should, search_type)
+        query_field_values = [(field, text) for field in NFT_TEXT_QUERY_FIELDS]
+        add_text_query_multi(query_field_values, query, QueryMatchType.should, search_type, text_query_mode,
+                             TEXT_QUERY_FIELD_BOOSTS[MultiSearchEndpoint.nfts])
         query["query"]["bool"]["minimum_should_match"] = 1
-        add_query_suggestions(text, query, text_query_fields)
-    res = es.search(index=NFTS_INDEX, body=query)
+        if (suggestion_strategy or SUGGESTION_STRATEGY) == SuggestionStrategy.per_field:
+            add_query_suggestions(query, query_field_values)
+        if (suggestion_strategy or SUGGESTION_STRATEGY) == SuggestionStrategy.single_field:
+            add_query_suggestion(text, SUGGESTION_FIELDS[MultiSearchEndpoint.nfts], query)
+    return query
 
-    if len(res["hits"]["hits"]) == 0 and not retrying:
-        suggestions = list(get_search_suggestion(res).values())
-        suggestion = suggestions[0] if suggestions else ""
-        if SearchType.any_words == search_type:
-            suggestion = " ".join(suggestions)
-        if suggestion:
-            return search_nfts(suggestion, search_type, page, size, retrying=True)
 
+def get_nfts_suggestion(res, search_type):
+    suggestions = list(get_search_suggestion(res).values())
+    suggestion = suggestions[0] if suggestions else ""
+    if SearchType.any_words == search_type:
+        suggestion = " ".join(suggestions)
+    return suggestion
+
+
+def get_nfts_response(res, text, page):
     data = list(map(lambda x: x["_source"], res["hits"]["hits"]))
     return {
         "page": page, "size": len(data), "total_count": res["hits"]["total"]["value"], "data": data,
@@ -254,13 +589,39 @@ def search_nfts(text="", search_type=SearchType.any_words, page: int = 1, size:
     }
 
 
-def search(es_index: str, must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values, prefix_field_values: dict = {}, sort_by: str = None,  page: int = 1, size: int = 10):
+async def async_search_nfts(text="", search_type=SearchType.any_words, page: int = 1, size: int = 10, retrying: bool = False):
+    query = get_nfts_query(text, search_type, page, size)
+    if SUGGESTION_RETRY_MODE == SuggestionRetryMode.msearch and text and not retrying:
+        res, fallback_res, suggest_res = await async_search_with_suggestion_fallback("nfts", NFTS_INDEX, query, NFT_FUZZY_FIELDS, text)
+        if fallback_res:
+            text = get_nfts_suggestion(suggest_res, search_type) or text
+            res = fallback_res
+        return get_nfts_response(res, text, page)
+
+    res = await async_es.search(index=NFTS_INDEX, body=query)
+
+    if len(res["hits"]["hits"]) == 0 and not retrying:
+        started = time.perf_counter()
+        suggestion = get_nfts_suggestion(await async_get_suggestion_response(MultiSearchEndpoint.nfts, NFTS_INDEX, res, text), search_type)
+        if suggestion and suggestion != text:
+            retry_res = await async_search_nfts(suggestion, search_type, page, size, retrying=True)
+            record_suggestion_retry("nfts", time.perf_counter() - started)
+            return retry_res
+
+    return get_nfts_response(res, text, page)
+
+
+def get_search_query(must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values, prefix_field_values: dict = {}, sort_by: str = None,  page: int = 1, size: int = 10,
+                     suggestion_strategy: SuggestionStrategy = None, term_field_values: dict = {}, date_range_field_values: dict = {},
+                     source_includes: list = None, text_query_mode: TextQueryMode = None, field_boosts: dict = {},
+                     suggestion_field: str = None):
     query = {
         "query": {
             "bool": {
                 "must_not": [],
                 "must": [],
                 "should": [],
+                "filter": [],
             }
         },
         "size": size,
@@ -269,25 +630,413 @@ def search(es_index: str, must_query_field_values, should_query_field_values, se
     }
     if sort_by:
         query["sort"] = sort_by
-    add_match_query_multi(should_query_field_values.items(),
-                          query, QueryMatchType.should, search_type)
+    if source_includes:
+        query["_source"] = source_includes
+    add_text_query_multi(should_query_field_values.items(), query, QueryMatchType.should, search_type, text_query_mode, field_boosts)
     add_match_query_multi(must_query_field_values.items(),
                           query, QueryMatchType.must, search_type)
-    add_query_suggestions(query, should_query_field_values.items())
-    add_query_suggestions(query, must_query_field_values.items())
+    if (suggestion_strategy or SUGGESTION_STRATEGY) == SuggestionStrategy.per_field:
+        add_query_suggestions(query, should_query_field_values.items())
+        add_query_suggestions(query, must_query_field_values.items())
+    if (suggestion_strategy or SUGGESTION_STRATEGY) == SuggestionStrategy.single_field:
+        add_single_field_suggestion(query, should_query_field_values, suggestion_field)
+    # non-scoring constraints go to filter context so ES can cache them
+    add_term_query_multi(term_field_values.items(), query)
+    add_date_range_query_multi(date_range_field_values.items(), query)
     add_range_query_multi(gte_range_query_field_values.items(), query)
     add_prefix_query_multi(prefix_field_values.items(), query)
     if query["query"]["bool"]["should"]:
         query["query"]["bool"]["minimum_should_match"] = 1
-    res = es.search(index=es_index, body=query)
+    return query
+
+
+class TemplateSlot(str):
+    """Stands in for a parameter value while a query template is compiled."""
+
+    # only values that passed the builders' checks get a slot, see get_query_shape
+    def __gt__(self, other):
+        return True
+
+    def isoformat(self):
+        return self
+
+
+_query_templates = {}
+
+
+def get_query_shape(must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values,
+                    prefix_field_values, sort_by, page, size, term_field_values, date_range_field_values, source_includes,
+                    search_after, pit_id, field_boosts, suggestion_field):
+    """Returns the key of the query template async_search() args render with, and the values of its slots in slot order."""
+    must_fields = tuple(field for field, value in must_query_field_values.items() if value)
+    should_fields = tuple(field for field, value in should_query_field_values.items() if value)
+    gte_fields = tuple(field for field, value in gte_range_query_field_values.items() if value and value > 0)
+    # should fields sharing a text share its slot, which is also what multi_match groups its fields by
+    should_values = list(dict.fromkeys(should_query_field_values[field] for field in should_fields))
+    should_slots = tuple(should_values.index(should_query_field_values[field]) for field in should_fields)
+    values = [must_query_field_values[field] for field in must_fields] + should_values
+    values += [gte_range_query_field_values[field] for field in gte_fields]
+    term_counts = []
+    for field, value in term_field_values.items():
+        terms = get_terms(value)
+        if terms:
+            term_counts.append((field, len(terms)))
+            values += terms
+    date_bounds = []
+    for field, bounds in date_range_field_values.items():
+        date_bounds.append((field, tuple(bool(bound) for bound in bounds)))
+        values += [bound.isoformat() for bound in bounds if bound]
+    # `fields` come from the client, so _source is a value rather than part of the skeleton
+    if source_includes:
+        values.append(source_includes)
+    values += [size, (page - 1 if page > 0 else 0) * size]
+    if search_after:
+        values.append(search_after)
+    if pit_id:
+        values.append(pit_id)
+    key = (must_fields, should_fields, should_slots, search_type, gte_fields, tuple(term_counts), tuple(date_bounds),
+           repr(prefix_field_values), repr(sort_by), bool(source_includes), bool(search_after), bool(pit_id),
+           SUGGESTION_STRATEGY, TEXT_QUERY_MODE, tuple(field_boosts.items()), suggestion_field)
+    return key, values
+
+
+def compile_query_template(key, prefix_field_values, sort_by):
+    must_fields, should_fields, should_slots, search_type, gte_fields, term_counts, date_bounds, _, _, with_source_includes, \
+        with_search_after, with_pit, suggestion_strategy, text_query_mode, field_boosts, suggestion_field = key
+    slots = itertools.count()
+
+    def slot():
+        return TemplateSlot(f"@@{next(slots)}@@")
+
+    must_query_field_values = {field: slot() for field in must_fields}
+    should_values = [slot() for _ in range(len(set(should_slots)))]
+    query = get_search_query(
+        must_query_field_values, {field: should_values[index] for field, index in zip(should_fields, should_slots)}, search_type,
+        {field: slot() for field in gte_fields}, prefix_field_values, sort_by, suggestion_strategy=suggestion_strategy,
+        term_field_values={field: ",".join(slot() for _ in range(count)) for field, count in term_counts},
+        date_range_field_values={field: tuple(slot() if present else None for present in bounds) for field, bounds in date_bounds},
+        source_includes=slot() if with_source_includes else None, text_query_mode=text_query_mode,
+        field_boosts=dict(field_boosts), suggestion_field=suggestion_field)
+    query["size"] = slot()
+    query["from"] = slot()
+    request = get_search_request(None, query, slot() if with_search_after else None, slot() if with_pit else None)
+    count = next(slots)
+    pieces = QUERY_TEMPLATE_SLOT.split(QUERY_TEMPLATE_ENCODER.encode(request["body"]))
+    template = [pieces[0].replace("{", "{{").replace("}", "}}")]
+    embedded = False
+    for whole, inside, part in zip(pieces[1::3], pieces[2::3], pieces[3::3]):
+        # whole slots replace the quoted marker, embedded ones sit inside a string like "2022-05-01||/d" and
+        # format the value's encoding without its quotes, passed after all the whole encodings
+        template.append(f"{{{whole}}}" if whole is not None else f"{{{count + int(inside)}}}")
+        template.append(part.replace("{", "{{").replace("}", "}}"))
+        embedded = embedded or whole is None
+    metrics.incr("query_templates_compiled_total")
+    return "".join(template), embedded, "index" in request
+
+
+def render_query_template(template, values):
+    body, embedded, with_index = template
+    encoded = [QUERY_TEMPLATE_ENCODER.encode(value) for value in values]
+    if embedded:
+        encoded += [value[1:-1] for value in encoded]
+    return body.format(*encoded), with_index
+
+
+def get_templated_search_request(es_index: str, must_query_field_values, should_query_field_values, search_type,
+                                 gte_range_query_field_values, prefix_field_values: dict = {}, sort_by: str = None, page: int = 1,
+                                 size: int = 10, search_after: list = None, pit_id: str = None, term_field_values: dict = {},
+                                 date_range_field_values: dict = {}, source_includes: list = None, field_boosts: dict = {},
+                                 suggestion_field: str = None):
+    key, values = get_query_shape(
+        must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values, prefix_field_values,
+        sort_by, page, size, term_field_values, date_range_field_values, source_includes, search_after, pit_id, field_boosts,
+        suggestion_field)
+    template = _query_templates.get(key)
+    if template is None:
+        if len(_query_templates) >= QUERY_TEMPLATE_CACHE_SIZE:
+            _query_templates.clear()
+        template = _query_templates[key] = compile_query_template(key, prefix_field_values, sort_by)
+    body, with_index = render_query_template(template, values)
+    return {"index": es_index, "body": body} if with_index else {"body": body}
+
+
+def get_search_request_for_args(es_index: str, must_query_field_values, should_query_field_values, search_type,
+                                gte_range_query_field_values, prefix_field_values: dict = {}, sort_by: str = None, page: int = 1,
+                                size: int = 10, search_after: list = None, pit_id: str = None, term_field_values: dict = {},
+                                date_range_field_values: dict = {}, source_includes: list = None, field_boosts: dict = {},
+                                suggestion_field: str = None):
+    # hashtag search rewrites every word of the text, so its body depends on more than where the values go
+    if QUERY_TEMPLATES_ENABLED and search_type != SearchType.hashtags:
+        return get_templated_search_request(es_index, must_query_field_values, should_query_field_values, search_type,
+                                            gte_range_query_field_values, prefix_field_values, sort_by, page, size,
+                                            search_after, pit_id, term_field_values, date_range_field_values, source_includes,
+                                            field_boosts, suggestion_field)
+    query = get_search_query(must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values,
+                             prefix_field_values, sort_by, page, size, term_field_values=term_field_values,
+                             date_range_field_values=date_range_field_values, source_includes=source_includes,
+                             field_boosts=field_boosts, suggestion_field=suggestion_field)
+    return get_search_request(es_index, query, search_after, pit_id)
+
+
+async def async_search(es_index: str, must_query_field_values, should_query_field_values, search_type, gte_range_query_field_values, prefix_field_values: dict = {}, sort_by: str = None,  page: int = 1, size: int = 10,
+                       search_after: list = None, pit_id: str = None, term_field_values: dict = {}, date_range_field_values: dict = {},
+                       source_includes: list = None, field_boosts: dict = {}, suggestion_field: str = None):
+    with span("query_build"):
+        request = get_search_request_for_args(es_index, must_query_field_values, should_query_field_values, search_type,
+                                              gte_range_query_field_values, prefix_field_values, sort_by, page, size, search_after,
+                                              pit_id, term_field_values, date_range_field_values, source_includes, field_boosts,
+                                              suggestion_field)
+    with expired_cursor_check(pit_id):
+        res = await async_es.search(**request)
     return res
 
 
+def encode_cursor(search_after: list, pit_id: str = None) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"search_after": search_after, "pit_id": pit_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data["search_after"], data.get("pit_id")
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursorError(f"Invalid cursor '{cursor}'")
+
+
+def uses_point_in_time(cursor: str = None, consistent: bool = False) -> bool:
+    """Whether a search opens or continues a point in time, whose cursor belongs to one client and is closed on its last page."""
+    if consistent:
+        return True
+    try:
+        return bool(cursor and decode_cursor(cursor)[1])
+    except InvalidCursorError:
+        return False
+
+
+def get_next_cursor(res, size: int, pit_id: str = None):
+    hits = res["hits"]["hits"]
+    if not hits or len(hits) < size or "sort" not in hits[-1]:
+        return None
+    # ES may hand back a new point in time id on every page
+    return encode_cursor(hits[-1]["sort"], res.get("pit_id", pit_id))
+
+
+async def async_close_exhausted_cursor(res, pit_id: str = None, next_cursor: str = None):
+    if pit_id and not next_cursor:
+        await async_es.close_point_in_time(body={"id": res.get("pit_id", pit_id)}, ignore=404)
+
+
+@contextmanager
+def expired_cursor_check(pit_id: str = None):
+    try:
+        yield
+    except NotFoundError as e:
+        # ES drops a point in time keep_alive after its last use, a cursor holding it cannot be resumed
+        if pit_id and e.error == "search_context_missing_exception":
+            raise ExpiredCursorError("Cursor expired, restart the search without a cursor") from e
+        raise
+
+
+async def async_get_cursor_args(es_index: str, cursor: str = None, consistent: bool = False):
+    search_after, pit_id = decode_cursor(cursor) if cursor else (None, None)
+    if consistent and not pit_id:
+        pit_id = (await async_es.open_point_in_time(index=es_index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    return search_after, pit_id
+
+
+async def async_iter_search_export(es_index: str, query):
+    """Yields the `_source` of every hit of ``query``, a search_after page at a time inside one point in time."""
+    query["track_total_hits"] = False
+    size = query["size"]
+    pit_id = (await async_es.open_point_in_time(index=es_index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    search_after = None
+    try:
+        while True:
+            res = await async_es.search(**get_search_request(es_index, query, search_after, pit_id))
+            pit_id = res.get("pit_id", pit_id)
+            hits = res["hits"]["hits"]
+            metrics.incr("export_documents_total", len(hits))
+            for hit in hits:
+                yield hit["_source"]
+            if len(hits) < size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        # also runs when the client goes away mid-stream, where the response task is being cancelled
+        await asyncio.shield(async_es.close_point_in_time(body={"id": pit_id}))
+
+
+def get_search_request(es_index: str, query, search_after: list = None, pit_id: str = None):
+    if search_after:
+        query["search_after"] = search_after
+        query.pop("from", None)
+    if pit_id:
+        # a point in time already pins the index, ES rejects requests naming both
+        query["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+        return {"body": query}
+    return {"index": es_index, "body": query}
+
+
+def get_multi_search_index(endpoint: MultiSearchEndpoint, params: dict):
+    if endpoint == MultiSearchEndpoint.publications:
+        return POSTS_INDEX_ROUTING.get_index(params["from_date"], params["to_date"])
+    if endpoint == MultiSearchEndpoint.profiles:
+        return LENS_PROFILE_INDEX
+    return NFTS_INDEX
+
+
+def get_multi_search_request(endpoint: MultiSearchEndpoint, params: dict, search_after: list = None, pit_id: str = None):
+    search_params = {key: value for key, value in params.items() if key not in ("page", "size", "cursor", "consistent")}
+    page, size = params["page"], params["size"]
+    if endpoint == MultiSearchEndpoint.publications:
+        query = get_search_query(**get_publications_search_args(**search_params), page=page, size=size)
+    elif endpoint == MultiSearchEndpoint.profiles:
+        query = get_search_query(**get_profiles_search_args(**search_params), page=page, size=size)
+    else:
+        query = get_nfts_query(page=page, size=size, **search_params)
+    request = get_search_request(get_multi_search_index(endpoint, params), query, search_after, pit_id)
+    # the msearch header names the index unless a point in time pins it
+    return [{"index": request["index"]} if "index" in request else {}, request["body"]]
+
+
+def get_multi_search_response(endpoint: MultiSearchEndpoint, params: dict, res):
+    if endpoint == MultiSearchEndpoint.publications:
+        return get_publications_response(res, params["text"], params["min_collects"], params["min_comments"], params["min_mirror"],
+                                         params["page"], get_next_cursor(res, params["size"]))
+    if endpoint == MultiSearchEndpoint.profiles:
+        return get_profiles_response(res, params["text"], params["owned_by"], params["min_follower"], params["min_posts"],
+                                     params["min_publications"], params["min_comments"], params["page"])
+    return get_nfts_response(res, params["text"], params["page"])
+
+
+def needs_multi_search_fallback(params: dict, res):
+    # errors and zero-hit suggestion retries go through the endpoint's own search function
+    return "error" in res or (not res["hits"]["hits"] and not params.get("cursor"))
+
+
+async def async_multi_search(queries):
+    """Runs (endpoint, params) sub-queries in one _msearch round trip, results in query order."""
+    cursor_args = [await async_get_cursor_args(get_multi_search_index(endpoint, params), params.get("cursor"), params.get("consistent", False))
+                   for endpoint, params in queries]
+    with span("query_build"):
+        body = [line for (endpoint, params), (search_after, pit_id) in zip(queries, cursor_args)
+                for line in get_multi_search_request(endpoint, params, search_after, pit_id)]
+    responses = (await async_es.msearch(body=body))["responses"]
+    metrics.incr("multi_search_queries_total", len(queries))
+    results = []
+    for (endpoint, params), res, (search_after, pit_id) in zip(queries, responses, cursor_args):
+        if needs_multi_search_fallback(params, res):
+            metrics.incr("multi_search_fallback_total", endpoint=endpoint.value)
+            if pit_id and not params.get("cursor"):
+                # hand over the point in time opened above instead of opening another one
+                params = {**params, "cursor": encode_cursor(None, pit_id)}
+            results.append(await ASYNC_MULTI_SEARCH_FUNCTIONS[endpoint](**params))
+        else:
+            result = get_multi_search_response(endpoint, params, res)
+            await async_close_exhausted_cursor(res, pit_id, result.get("next_cursor"))
+            results.append(result)
+    return results
+
+
+ASYNC_MULTI_SEARCH_FUNCTIONS = {
+    MultiSearchEndpoint.publications: async_search_publications,
+    MultiSearchEndpoint.profiles: async_search_profiles,
+    MultiSearchEndpoint.nfts: async_search_nfts,
+}
+
+
+def get_fuzzy_clause(clause, fields):
+    if "multi_match" in clause:
+        params = dict(clause["multi_match"])
+        if not all(field.split("^")[0] in fields for field in params["fields"]):
+            return clause
+        # ES allows fuzziness on neither cross_fields nor phrase, best_fields scores closest to them
+        if params["type"] == "phrase":
+            params["operator"] = "and"
+        params.update(type=MultiMatchType.best_fields.value, fuzziness="AUTO")
+        return {"multi_match": params}
+    for match_type in ("match", "match_phrase"):
+        if match_type not in clause:
+            continue
+        (field, params), = clause[match_type].items()
+        if field not in fields:
+            return clause
+        params = dict(params, fuzziness="AUTO")
+        if match_type == "match_phrase":
+            params["operator"] = "and"
+        return {"match": {field: params}}
+    return clause
+
+
+def get_fuzzy_query(query, fields):
+    fuzzy_query = copy.deepcopy(query)
+    fuzzy_query.pop("suggest", None)
+    bool_query = fuzzy_query["query"]["bool"]
+    for match_type in (QueryMatchType.should, QueryMatchType.must):
+        bool_query[str(match_type)] = [get_fuzzy_clause(clause, fields) for clause in bool_query[str(match_type)]]
+    return fuzzy_query
+
+
+def get_suggestion_msearch_body(endpoint: MultiSearchEndpoint, es_index: str, query, fuzzy_fields, text: str, routed_index: str = None):
+    # suggestions come from the whole alias, only the searches are narrowed to the routed indices
+    search_index = routed_index or es_index
+    body = [{"index": search_index}, query, {"index": search_index}, get_fuzzy_query(query, fuzzy_fields)]
+    if SUGGESTION_STRATEGY == SuggestionStrategy.lazy and text:
+        body += [{"index": es_index}, get_suggestion_query(endpoint, text)]
+    return body
+
+
+def get_suggestion_msearch_response(endpoint: str, responses):
+    res, fallback_res = responses[:2]
+    suggest_res = responses[2] if len(responses) > 2 else res
+    if "error" in res:
+        raise TransportError(res.get("status", 500), res["error"].get("type"), res["error"])
+    metrics.incr("suggestion_fallback_queries_total", endpoint=endpoint)
+    if res["hits"]["hits"] or "error" in fallback_res:
+        return res, None, suggest_res
+    # the fallback ran alongside the original query, so the cost it adds is its own shard time
+    record_suggestion_retry(endpoint, fallback_res["took"] / 1000)
+    return res, fallback_res, suggest_res
+
+
+async def async_search_with_suggestion_fallback(endpoint: str, es_index: str, query, fuzzy_fields, text: str, routed_index: str = None):
+    body = get_suggestion_msearch_body(MultiSearchEndpoint(endpoint), es_index, query, fuzzy_fields, text, routed_index)
+    responses = (await async_es.msearch(body=body))["responses"]
+    return get_suggestion_msearch_response(endpoint, responses)
+
+
+def get_suggestion_query(endpoint: MultiSearchEndpoint, text: str):
+    field = SUGGESTION_FIELDS[endpoint]
+    return {
+        "query": {"match_none": {}},
+        "size": 0,
+        "track_total_hits": False,
+        "suggest": {field: {"text": text, "term": {"field": field}}}
+    }
+
+
+async def async_get_suggestion_response(endpoint: MultiSearchEndpoint, es_index: str, res, text: str):
+    if SUGGESTION_STRATEGY == SuggestionStrategy.lazy and text:
+        return await async_es.search(index=es_index, body=get_suggestion_query(endpoint, text))
+    return res
+
+
+def record_suggestion_retry(endpoint: str, seconds: float):
+    metrics.incr("suggestion_retry_total", endpoint=endpoint, mode=SUGGESTION_RETRY_MODE.value)
+    metrics.incr("suggestion_retry_seconds_total", seconds, endpoint=endpoint, mode=SUGGESTION_RETRY_MODE.value)
+    add_span("suggestion_retry", seconds)
+
+
 def add_query_suggestions(query, field_values):
     for field, q in field_values:
         add_query_suggestion(q, field, query)
 
 
+def add_single_field_suggestion(query, field_values: dict, field: str = None):
+    if field:
+        add_query_suggestion(field_values.get(field), field, query)
+
+
 def add_query_suggestion(q, field, query):
     if q:
         query["suggest"].update({
@@ -319,15 +1068,17 @@ def get_search_suggestion(res, flatten=True):
     return out
 
 
-def get_trends(size: int = 10, days_back: int = 1):
+def get_trends_query(size: int = 10, days_back: int = 1, app_id: str = None, window: TrendsWindow = None, app_ids_size: int = 0):
+    window_length = TRENDS_WINDOWS[window] if window else timedelta(days=days_back)
+    since = datetime.now() - window_length
     query = {
         "query": {
             "bool": {
-                "must": [
+                "filter": [
                     {
                         "range": {
                             "ingested_at": {
-                                "gte": (datetime.now()-timedelta(days=days_back)).isoformat(),
+                                "gte": since.isoformat(),
                                 "lte": "now"
                             }
                         }
@@ -337,16 +1088,68 @@ def get_trends(size: int = 10, days_back: int = 1):
         },
         "size": 0,
         "aggs": {
-            "trends": {
-                "significant_text": {
-                    "field": "count",
-                    "min_doc_count": 3,
-                    "size": size
+            "sample": {
+                "sampler": {"shard_size": TRENDS_SAMPLER_SHARD_SIZE},
+                "aggs": {
+                    "trends": {
+                        "significant_text": {
+                            "field": "count",
+                            "min_doc_count": 3,
+                            "size": size
+                        }
+                    }
                 }
             }
         }
     }
-    return [keyword for keyword in es.search(index=INDEX, body=query)['aggregations']['trends']['buckets'] if keyword['key'][0].isalpha()]
+    add_term_query("appId", app_id, query)
+    # a filter-only query scores every post alike and the sampler would keep an arbitrary, mostly oldest, slice
+    # of each shard; scoring by recency makes it keep the newest posts of the window
+    query["query"] = {
+        "function_score": {
+            "query": query["query"],
+            "functions": [{"gauss": {"ingested_at": {"origin": "now", "scale": f"{int(window_length.total_seconds() * TRENDS_DECAY_SCALE)}s",
+                                                     "decay": 0.5}}}],
+            "boost_mode": "replace"
+        }
+    }
+    if app_ids_size:
+        # per app_id trends of the busiest apps in the same request
+        query["aggs"]["app-ids"] = {
+            "terms": {"field": "appId.keyword", "size": app_ids_size},
+            "aggs": {"sample": copy.deepcopy(query["aggs"]["sample"])}
+        }
+    return query
+
+
+def is_trend_keyword(keyword):
+    return keyword['key'][0].isalpha()
+
+
+def get_trends_response(res):
+    return [keyword for keyword in res['aggregations']['sample']['trends']['buckets'] if is_trend_keyword(keyword)]
+
+
+def get_windowed_trends_response(res, size: int):
+    trends_by_app_id = {
+        bucket['key']: [keyword for keyword in bucket['sample']['trends']['buckets'] if is_trend_keyword(keyword)][:size]
+        for bucket in res['aggregations'].get('app-ids', {}).get('buckets', [])
+    }
+    return get_trends_response(res)[:size], trends_by_app_id
+
+
+def get_trends_index(days_back: int = 1, window: TrendsWindow = None):
+    return DATA_INDEX_ROUTING.get_index(datetime.now() - (TRENDS_WINDOWS[window] if window else timedelta(days=days_back)))
+
+
+async def async_get_trends(size: int = 10, days_back: int = 1, app_id: str = None, window: TrendsWindow = None):
+    res = await async_es.search(index=get_trends_index(days_back, window), body=get_trends_query(size, days_back, app_id, window))
+    return get_trends_response(res)
+
+
+async def async_get_windowed_trends(size: int, window: TrendsWindow, app_ids_size: int = 0):
+    query = get_trends_query(size * 2, window=window, app_ids_size=app_ids_size)
+    return get_windowed_trends_response(await async_es.search(index=get_trends_index(window=window), body=query), size)
 
 
 def add_ingested_date(post, ingested_at):
@@ -363,7 +1166,13 @@ def index_contents(contents):
             "_source": add_ingested_date(content, ingested_at),
         } for content in contents
     ]
-    helpers.bulk(es, actions)
+    # without retries the results come back in action order
+    results = helpers.streaming_bulk(es, actions)
+    created = [content for content, (_, result) in zip(contents, results) if next(iter(result.values())).get("result") == "created"]
+    try:
+        index_hashtag_suggestions(created)
+    except Exception:
+        logger.exception("Hashtag suggestions of %s documents failed", len(created))
 
 
 def add_match_query(field, value, query, match_type: QueryMatchType, search_type: SearchType = SearchType.any_words):
@@ -372,13 +1181,33 @@ def add_match_query(field, value, query, match_type: QueryMatchType, search_type
         query["query"]["bool"][str(match_type)].append(res)
 
 
-def add_prefix_query(field, value, query, match_type: QueryMatchType = QueryMatchType.must):
+def add_multi_match_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.should,
+                                search_type: SearchType = SearchType.any_words, field_boosts: dict = {}):
+    # fields searched for the same text share one clause
+    fields_by_value = {}
+    for field, value in field_values:
+        if value:
+            fields_by_value.setdefault(value, []).append(field)
+    for value, fields in fields_by_value.items():
+        query["query"]["bool"][str(match_type)].append(get_multi_match_query(search_type, value, fields, field_boosts))
+
+
+def add_text_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.should,
+                         search_type: SearchType = SearchType.any_words, text_query_mode: TextQueryMode = None,
+                         field_boosts: dict = {}):
+    if (text_query_mode or TEXT_QUERY_MODE) == TextQueryMode.multi_match:
+        add_multi_match_query_multi(field_values, query, match_type, search_type, field_boosts)
+    else:
+        add_match_query_multi(field_values, query, match_type, search_type)
+
+
+def add_prefix_query(field, value, query, match_type: QueryMatchType = QueryMatchType.filter):
     if value:
-        query["query"]["bool"][match_type].append(
+        query["query"]["bool"][str(match_type)].append(
             {"prefix": {field: {"value": value}}})
 
 
-def add_prefix_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.must):
+def add_prefix_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.filter):
     for field, value in field_values:
         add_prefix_query(field, value, query, match_type)
 
@@ -388,20 +1217,55 @@ def add_match_query_multi(field_values, query, match_type: QueryMatchType = Quer
         add_match_query(field, value, query, match_type, search_type)
 
 
-def add_range_query(field, value, query, match_type: QueryMatchType = QueryMatchType.must, range_cmp="gte"):
+def add_range_query(field, value, query, match_type: QueryMatchType = QueryMatchType.filter, range_cmp="gte"):
     if value and value > 0:
         query["query"]["bool"][str(match_type)].append(
             {"range": {field: {range_cmp: value}}})
 
 
-def add_range_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.must, range_cmp="gte"):
+def add_range_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.filter, range_cmp="gte"):
     for field, value in field_values:
         add_range_query(field, value, query,
                         match_type=match_type, range_cmp=range_cmp)
 
 
-def get_app_ids(size: int = 10):
-    query = {
+def get_terms(value: str):
+    return [term for term in re.split(r"[,\s]+", value) if term] if value else []
+
+
+def add_term_query(field, value, query, match_type: QueryMatchType = QueryMatchType.filter):
+    # exact ids are matched on the keyword sub-field, several can be given comma or space separated
+    values = get_terms(value)
+    if len(values) == 1:
+        query["query"]["bool"][str(match_type)].append({"term": {f"{field}.keyword": values[0]}})
+    elif values:
+        query["query"]["bool"][str(match_type)].append({"terms": {f"{field}.keyword": values}})
+
+
+def add_date_range_query(field, date_range, query, match_type: QueryMatchType = QueryMatchType.filter):
+    from_date, to_date = date_range
+    bounds = {}
+    # rounding to the day keeps to_date inclusive for datetime fields
+    if from_date:
+        bounds["gte"] = f"{from_date.isoformat()}||/d"
+    if to_date:
+        bounds["lte"] = f"{to_date.isoformat()}||/d"
+    if bounds:
+        query["query"]["bool"][str(match_type)].append({"range": {field: bounds}})
+
+
+def add_date_range_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.filter):
+    for field, date_range in field_values:
+        add_date_range_query(field, date_range, query, match_type)
+
+
+def add_term_query_multi(field_values, query, match_type: QueryMatchType = QueryMatchType.filter):
+    for field, value in field_values:
+        add_term_query(field, value, query, match_type)
+
+
+def get_app_ids_query(size: int = 10):
+    return {
         "aggs": {
             "app-ids": {
                 "terms": {
@@ -412,4 +1276,8 @@ def get_app_ids(size: int = 10):
         },
         "size": 0
     }
-    return [keyword for keyword in es.search(index=POSTS_INDEX, body=query)['aggregations']['app-ids']['buckets']]
+
+
+async def async_get_app_ids(size: int = 10):
+    res = await async_es.search(index=POSTS_INDEX, body=get_app_ids_query(size))
+    return [keyword for keyword in res['aggregations']['app-ids']['buckets']]
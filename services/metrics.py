@@ -0,0 +1,58 @@
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+HISTOGRAM_BUCKETS = [float(bucket) for bucket in
+                     os.getenv("HISTOGRAM_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")]
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+
+
+def get_metric_key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def incr(name: str, value: float = 1, **labels):
+    key = get_metric_key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def set_gauge(name: str, value: float, **labels):
+    key = get_metric_key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, **labels):
+    key = get_metric_key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"counts": [0] * (len(HISTOGRAM_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        # per-bucket counts, made cumulative like prometheus "le" buckets when read
+        histogram["counts"][bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def get_histogram(histogram: dict):
+    buckets = {}
+    total = 0
+    for bound, count in zip(HISTOGRAM_BUCKETS + ["+Inf"], histogram["counts"]):
+        total += count
+        buckets[str(bound)] = total
+    return {"buckets": buckets, "sum": histogram["sum"], "count": histogram["count"]}
+
+
+def get_metrics():
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges),
+                "histograms": {key: get_histogram(histogram) for key, histogram in _histograms.items()}}
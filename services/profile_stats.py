@@ -0,0 +1,62 @@
+import argparse
+import os
+
+from elasticsearch import helpers
+
+from services.es_search import es
+
+# profiles whose posts one update_by_query rewrites
+PROFILE_STATS_SYNC_BATCH = int(os.getenv("PROFILE_STATS_SYNC_BATCH", 200))
+PROFILE_STATS_SYNC_TIMEOUT = int(os.getenv("PROFILE_STATS_SYNC_TIMEOUT", 300))
+# touches only profile.stats, posts already carrying the new numbers are skipped without a write
+PROFILE_STATS_SCRIPT = """
+def stats = params.stats[ctx._source.profile.id];
+if (stats == null || stats.equals(ctx._source.profile.stats)) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.profile.stats = stats;
+}
+"""
+
+
+def get_profile_stats_update_body(stats_by_profile: dict):
+    return {
+        "query": {"bool": {"filter": [{"terms": {"profile.id.keyword": list(stats_by_profile)}}]}},
+        "script": {"source": PROFILE_STATS_SCRIPT, "lang": "painless", "params": {"stats": stats_by_profile}}
+    }
+
+
+def sync_profile_stats(posts_index: str, stats_by_profile: dict):
+    """Copies profile stats into the posts embedding them, one update_by_query per batch of profiles. Returns the posts updated."""
+    profile_ids = list(stats_by_profile)
+    updated = 0
+    for i in range(0, len(profile_ids), PROFILE_STATS_SYNC_BATCH):
+        batch = {profile_id: stats_by_profile[profile_id] for profile_id in profile_ids[i:i + PROFILE_STATS_SYNC_BATCH]}
+        # a post written by the ingest pipeline meanwhile already has fresh stats, so version conflicts are skipped
+        res = es.update_by_query(index=posts_index, body=get_profile_stats_update_body(batch), conflicts="proceed",
+                                 slices="auto", request_timeout=PROFILE_STATS_SYNC_TIMEOUT)
+        updated += res["updated"]
+    return updated
+
+
+def get_profile_stats(profile_index: str):
+    return {hit["_source"]["id"]: hit["_source"]["stats"]
+            for hit in helpers.scan(es, index=profile_index, _source=["id", "stats"])
+            if hit["_source"].get("id") and hit["_source"].get("stats")}
+
+
+def backfill(profile_index: str, posts_index: str):
+    stats_by_profile = get_profile_stats(profile_index)
+    updated = sync_profile_stats(posts_index, stats_by_profile)
+    print(f"Synced stats of {len(stats_by_profile)} profiles, {updated} posts updated")
+
+
+if __name__ == "__main__":
+    from services.lens_service import LENS_PROFILE_INDEX, POSTS_INDEX
+
+    parser = argparse.ArgumentParser(description="Copy the stats of every profile into the posts embedding them.")
+    parser.add_argument("--profile-index", default=LENS_PROFILE_INDEX)
+    parser.add_argument("--posts-index", default=POSTS_INDEX)
+    args = parser.parse_args()
+    es.init_app()
+    backfill(args.profile_index, args.posts_index)
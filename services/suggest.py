@@ -0,0 +1,178 @@
+import argparse
+import os
+import re
+from enum import Enum
+from typing import List
+
+from elasticsearch import helpers
+from elasticsearch.helpers import async_bulk
+
+from services import metrics
+from services.es_search import es, async_es
+
+SUGGEST_INDEX = os.getenv("SUGGEST_INDEX", "lens-suggest")
+SUGGEST_MAX_SIZE = int(os.getenv("SUGGEST_MAX_SIZE", 20))
+HASHTAG_PATTERN = re.compile(r"#(\w{2,64})")
+# popular hashtags are in nearly every batch, concurrent bulks bump the same weights
+SUGGEST_RETRY_ON_CONFLICT = int(os.getenv("SUGGEST_RETRY_ON_CONFLICT", 5))
+
+
+class SuggestionKind(str, Enum):
+    handle = "handle"
+    profile_name = "profile_name"
+    nft_collection = "nft_collection"
+    hashtag = "hashtag"
+
+
+SUGGEST_INDEX_BODY = {
+    "settings": {
+        "analysis": {
+            "analyzer": {
+                # whole value as one lowercased token, so "stani.l" still prefixes "stani.lens"
+                "suggest_keyword": {"type": "custom", "tokenizer": "keyword", "filter": ["lowercase", "asciifolding"]}
+            }
+        }
+    },
+    "mappings": {
+        "properties": {
+            "kind": {"type": "keyword"},
+            "value": {"type": "keyword"},
+            "suggest": {
+                "type": "completion",
+                "analyzer": "suggest_keyword",
+                "contexts": [{"name": "kind", "type": "category", "path": "kind"}]
+            }
+        }
+    }
+}
+
+
+def get_suggest_inputs(kind: SuggestionKind, value: str):
+    if kind == SuggestionKind.handle:
+        # "stani.lens" is also typed as "stani"
+        return list(dict.fromkeys([value, value.split(".")[0]]))
+    # every word start of a multi word name, "kulec" finds "Stani Kulechov"
+    words = value.split()
+    return [" ".join(words[i:]) for i in range(len(words))] or [value]
+
+
+def get_suggest_action(kind: SuggestionKind, value: str, weight: int = 1):
+    return {
+        "_index": SUGGEST_INDEX,
+        "_id": f"{kind.value}:{value.lower()}",
+        "_source": {
+            "kind": kind.value,
+            "value": value,
+            "suggest": {"input": get_suggest_inputs(kind, value), "weight": max(int(weight or 0), 1)}
+        }
+    }
+
+
+def get_hashtag_suggest_actions(contents):
+    counts = {}
+    for content in contents:
+        for field in ("contents", "description"):
+            for hashtag in HASHTAG_PATTERN.findall(content.get(field) or ""):
+                counts[hashtag.lower()] = counts.get(hashtag.lower(), 0) + 1
+    # each publication bumps the weight of its hashtags, so popular hashtags rank first, callers only pass
+    # publications indexed for the first time so re-sending one never counts it twice
+    return [{
+        "_op_type": "update",
+        "_index": SUGGEST_INDEX,
+        "_id": f"{SuggestionKind.hashtag.value}:{hashtag}",
+        "retry_on_conflict": SUGGEST_RETRY_ON_CONFLICT,
+        "script": {"source": "ctx._source.suggest.weight += params.count", "params": {"count": count}},
+        "upsert": get_suggest_action(SuggestionKind.hashtag, hashtag, count)["_source"],
+    } for hashtag, count in counts.items()]
+
+
+def get_suggest_query(prefix: str, kinds: List[SuggestionKind] = None, size: int = 8):
+    return {
+        "_source": ["kind", "value"],
+        "suggest": {
+            "suggest": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "suggest",
+                    "size": min(size, SUGGEST_MAX_SIZE),
+                    "skip_duplicates": True,
+                    "contexts": {"kind": [kind.value for kind in (kinds or SuggestionKind)]}
+                }
+            }
+        }
+    }
+
+
+def get_suggest_response(res):
+    return [{**option["_source"], "score": option["_score"]} for option in res["suggest"]["suggest"][0]["options"]]
+
+
+async def async_suggest(prefix: str, kinds: List[SuggestionKind] = None, size: int = 8):
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    return get_suggest_response(await async_es.search(index=SUGGEST_INDEX, body=get_suggest_query(prefix, kinds, size)))
+
+
+async def async_ensure_suggest_index():
+    if not await async_es.indices.exists(index=SUGGEST_INDEX):
+        # several workers start at once, the losers get resource_already_exists
+        await async_es.indices.create(index=SUGGEST_INDEX, body=SUGGEST_INDEX_BODY, ignore=400)
+
+
+def index_hashtag_suggestions(contents):
+    # a bulk of its own, so failed suggestion updates never fail the content they came from
+    actions = get_hashtag_suggest_actions(contents)
+    if actions:
+        _, errors = helpers.bulk(es, actions, raise_on_error=False)
+        metrics.incr("suggest_index_errors_total", len(errors))
+
+
+async def async_index_hashtag_suggestions(contents):
+    actions = get_hashtag_suggest_actions(contents)
+    if actions:
+        _, errors = await async_bulk(async_es, actions, raise_on_error=False)
+        metrics.incr("suggest_index_errors_total", len(errors))
+
+
+def get_profile_suggest_actions(profile_index: str):
+    for hit in helpers.scan(es, index=profile_index, _source=["handle", "name", "stats.totalFollowers"]):
+        profile = hit["_source"]
+        followers = (profile.get("stats") or {}).get("totalFollowers", 1)
+        if profile.get("handle"):
+            yield get_suggest_action(SuggestionKind.handle, profile["handle"], followers)
+        if profile.get("name"):
+            yield get_suggest_action(SuggestionKind.profile_name, profile["name"], followers)
+
+
+def get_nft_collection_suggest_actions(nfts_index: str):
+    after = None
+    while True:
+        composite = {"size": 1000, "sources": [{"name": {"terms": {"field": "collectionName.keyword"}}}]}
+        if after:
+            composite["after"] = after
+        res = es.search(index=nfts_index, body={"size": 0, "aggs": {"collections": {"composite": composite}}})
+        buckets = res["aggregations"]["collections"]["buckets"]
+        for bucket in buckets:
+            yield get_suggest_action(SuggestionKind.nft_collection, bucket["key"]["name"], bucket["doc_count"])
+        after = res["aggregations"]["collections"].get("after_key")
+        if not buckets or not after:
+            return
+
+
+def backfill(profile_index: str, nfts_index: str):
+    es.indices.create(index=SUGGEST_INDEX, body=SUGGEST_INDEX_BODY, ignore=400)
+    for actions in (get_profile_suggest_actions(profile_index), get_nft_collection_suggest_actions(nfts_index)):
+        indexed, errors = helpers.bulk(es, actions, chunk_size=2000, raise_on_error=False)
+        print(f"Indexed {indexed} suggestions, {len(errors)} errors")
+
+
+if __name__ == "__main__":
+    from services.lens_service import LENS_PROFILE_INDEX, NFTS_INDEX
+
+    parser = argparse.ArgumentParser(description="Backfill the suggest index from the profile and NFT indices.")
+    parser.add_argument("--profile-index", default=LENS_PROFILE_INDEX)
+    parser.add_argument("--nfts-index", default=NFTS_INDEX)
+    args = parser.parse_args()
+    es.init_app()
+    backfill(args.profile_index, args.nfts_index)
@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from services import metrics
+
+_spans: ContextVar[Optional[List[dict]]] = ContextVar("spans", default=None)
+
+
+def start_spans():
+    # the list is shared, not copied, by the tasks and threadpool calls the request spawns
+    return _spans.set([])
+
+
+def reset_spans(token):
+    _spans.reset(token)
+
+
+def get_spans() -> List[dict]:
+    return _spans.get() or []
+
+
+def add_span(name: str, seconds: float, **fields):
+    spans = _spans.get()
+    if spans is not None:
+        spans.append({"name": name, "ms": round(seconds * 1000, 3), **fields})
+
+
+@contextmanager
+def span(name: str, **fields):
+    """Times the block as a span of the current request, extra fields can be set on the yielded dict."""
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        add_span(name, time.perf_counter() - started, **fields)
+
+
+def record_spans(endpoint: str, spans: List[dict], seconds: float):
+    metrics.observe("request_duration_seconds", seconds, endpoint=endpoint)
+    for item in spans:
+        metrics.observe("request_span_seconds", item["ms"] / 1000, endpoint=endpoint, span=item["name"])
+
+
+def get_server_timing(spans: List[dict], seconds: float) -> str:
+    entries = []
+    for item in spans:
+        # extra span fields, ES `took` or the cache hit flag, go to the description
+        desc = " ".join(f"{key}={value}" for key, value in item.items() if key not in ("name", "ms"))
+        entries.append(f'{item["name"]};dur={item["ms"]}' + (f';desc="{desc}"' if desc else ""))
+    return ", ".join(entries + [f"total;dur={round(seconds * 1000, 3)}"])
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import datetime
+
+from services import metrics
+from services.lens_service import TrendsWindow, async_get_windowed_trends
+
+logger = logging.getLogger(__name__)
+
+TRENDS_REFRESH_INTERVAL = int(os.getenv("TRENDS_REFRESH_INTERVAL", 600))
+# longer windows barely move between refreshes, TRENDS_REFRESH_INTERVAL_7D etc. override a single window
+TRENDS_REFRESH_INTERVALS = {
+    window: int(os.getenv(f"TRENDS_REFRESH_INTERVAL_{window.value.upper()}", default))
+    for window, default in ((TrendsWindow.hour, TRENDS_REFRESH_INTERVAL), (TrendsWindow.day, TRENDS_REFRESH_INTERVAL),
+                            (TrendsWindow.two_days, max(TRENDS_REFRESH_INTERVAL, 1800)),
+                            (TrendsWindow.week, max(TRENDS_REFRESH_INTERVAL, 3600)))
+}
+# how often workers check for a window that is due, a check is one Redis SET NX per window
+TRENDS_CHECK_INTERVAL = int(os.getenv("TRENDS_CHECK_INTERVAL", 60))
+# keywords stored per key, /trends asking for more falls back to computing
+TRENDS_SIZE = int(os.getenv("TRENDS_SIZE", 50))
+TRENDS_APP_IDS_SIZE = int(os.getenv("TRENDS_APP_IDS_SIZE", 20))
+# materialized keys survive this many failed refreshes of their window before /trends falls back to computing
+TRENDS_TTL_REFRESHES = int(os.getenv("TRENDS_TTL_REFRESHES", 5))
+TRENDS_KEY_PREFIX = os.getenv("TRENDS_KEY_PREFIX", "trends")
+TRENDS_MATERIALIZER_ENABLED = os.getenv("TRENDS_MATERIALIZER_ENABLED", "true").lower() == "true"
+
+
+def get_trends_key(window: TrendsWindow, app_id: str = None) -> str:
+    return f"{TRENDS_KEY_PREFIX}:{TrendsWindow(window).value}:{app_id or '_all'}"
+
+
+async def materialize_trends(redis, window: TrendsWindow) -> bool:
+    # one worker per window and interval computes, the lock is left to expire rather than released
+    interval = TRENDS_REFRESH_INTERVALS[window]
+    acquired = await redis.set(f"{TRENDS_KEY_PREFIX}:lock:{window.value}", f"{socket.gethostname()}:{os.getpid()}",
+                               expire=interval, exist=redis.SET_IF_NOT_EXIST)
+    if not acquired:
+        return False
+    computed_at = datetime.now().isoformat()
+    ttl = interval * TRENDS_TTL_REFRESHES
+    trends, trends_by_app_id = await async_get_windowed_trends(TRENDS_SIZE, window, TRENDS_APP_IDS_SIZE)
+    pipe = redis.pipeline()
+    pipe.set(get_trends_key(window), json.dumps({"computed_at": computed_at, "trends": trends}), expire=ttl)
+    for app_id, app_trends in trends_by_app_id.items():
+        pipe.set(get_trends_key(window, app_id), json.dumps({"computed_at": computed_at, "trends": app_trends}), expire=ttl)
+    await pipe.execute()
+    metrics.incr("trends_materialized_total", window=window.value)
+    return True
+
+
+async def read_trends(redis, window: TrendsWindow, app_id: str = None, size: int = 20):
+    if size > TRENDS_SIZE:
+        return None
+    raw = await redis.get(get_trends_key(window, app_id))
+    if raw is None:
+        return None
+    return json.loads(raw)["trends"][:size]
+
+
+class TrendsMaterializer:
+    """Recomputes the trends of each window, overall and for the busiest app ids, into Redis on the window's schedule."""
+
+    def __init__(self, interval: int = TRENDS_CHECK_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self, redis):
+        self._task = asyncio.ensure_future(self.run(redis))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self, redis):
+        while True:
+            for window in TrendsWindow:
+                try:
+                    await materialize_trends(redis, window)
+                except Exception:
+                    metrics.incr("trends_materialize_errors_total", window=window.value)
+                    logger.exception("Trends materialization of %s failed", window.value)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,166 @@
+"""Snapshots of the ES bodies the query builders generate.
+
+A failing case means a request now reaches ES with a different body. When the change is intended, rewrite the
+snapshots and review their diff:
+
+    UPDATE_SNAPSHOTS=1 python -m pytest tests
+"""
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+
+from services import lens_service
+from services.lens_service import (MultiSearchEndpoint, ResponseView, ResultType, SearchType, SuggestionStrategy, TextQueryMode,
+                                   TrendsWindow)
+
+SNAPSHOTS_PATH = os.path.join(os.path.dirname(__file__), "snapshots", "query_bodies.json")
+UPDATE_SNAPSHOTS = os.getenv("UPDATE_SNAPSHOTS") == "1"
+
+
+def get_search_defaults(suggestion_strategy=None, text_query_mode=None):
+    # pinned so the env of the test run cannot change the bodies
+    return {"suggestion_strategy": suggestion_strategy or SuggestionStrategy.single_field,
+            "text_query_mode": text_query_mode or TextQueryMode.per_field}
+
+
+def publications(page=1, size=10, suggestion_strategy=None, text_query_mode=None, **params):
+    args = lens_service.get_publications_search_args(**params)
+    return lens_service.get_search_query(**args, page=page, size=size, **get_search_defaults(suggestion_strategy, text_query_mode))
+
+
+def profiles(text="", bio=None, owned_by=None, min_follower=None, min_posts=None, min_publications=None, min_comments=None,
+             page=1, size=10, suggestion_strategy=None, text_query_mode=None):
+    args = lens_service.get_profiles_search_args(text, bio, owned_by, min_follower, min_posts, min_publications, min_comments)
+    return lens_service.get_search_query(**args, page=page, size=size, **get_search_defaults(suggestion_strategy, text_query_mode))
+
+
+def nfts(suggestion_strategy=None, text_query_mode=None, **params):
+    return lens_service.get_nfts_query(**params, **get_search_defaults(suggestion_strategy, text_query_mode))
+
+
+CASES = {
+    "publications_text": lambda: publications(text="lens protocol"),
+    "publications_exact_phrase_top": lambda: publications(text="lens protocol", search_type=SearchType.exact_phrase,
+                                                          result_type=ResultType.top),
+    "publications_all_words_multi_match": lambda: publications(text="lens protocol", search_type=SearchType.all_words,
+                                                               text_query_mode=TextQueryMode.multi_match),
+    "publications_terms": lambda: publications(app_id="lenster", from_users="stani.lens aave.lens"),
+    "publications_prefix": lambda: publications(text="gm", result_type=ResultType.photo),
+    "publications_links_prefix": lambda: publications(result_type=ResultType.links),
+    "publications_ranges": lambda: publications(min_collects=5, min_mirror=0, min_comments=2, min_profile_follower=100,
+                                                min_profile_posts=None),
+    "publications_date_window": lambda: publications(from_date=date(2022, 5, 1), to_date=date(2022, 5, 31)),
+    "publications_open_date_window": lambda: publications(text="lens", from_date=date(2022, 5, 1)),
+    "publications_bio_and_mentions": lambda: publications(text="lens", bio="builder", mention_users="@stani"),
+    "publications_card_view_page": lambda: publications(text="lens", view=ResponseView.card, page=2, size=20),
+    "publications_fields": lambda: publications(text="lens", fields="id, metadata.content, stats.*"),
+    "publications_all_filters": lambda: publications(
+        text="lens", bio="builder", from_users="stani.lens", mention_users="@aave", search_type=SearchType.any_words,
+        result_type=ResultType.video, min_collects=1, min_mirror=2, min_comments=3, min_profile_follower=4,
+        min_profile_posts=5, app_id="lenster,orb", from_date=date(2022, 1, 1), to_date=date(2022, 12, 31)),
+    "profiles_text": lambda: profiles(text="stani"),
+    "profiles_owned_by_ranges": lambda: profiles(owned_by="0xabc", min_follower=10, min_posts=0, min_comments=3),
+    "profiles_multi_match": lambda: profiles(text="stani", text_query_mode=TextQueryMode.multi_match),
+    "profiles_per_field_suggestions": lambda: profiles(text="stani", bio="aave", suggestion_strategy=SuggestionStrategy.per_field),
+    "comments": lambda: lens_service.get_publication_comments_query("0x01-0x01"),
+    "comments_page_fields": lambda: lens_service.get_publication_comments_query(
+        "0x01-0x01", page=3, size=25, source_includes=["id", "metadata.content"]),
+    "nfts_text": lambda: nfts(text="bored ape"),
+    "nfts_exact_phrase": lambda: nfts(text="bored ape", search_type=SearchType.exact_phrase, page=2),
+    "nfts_multi_match": lambda: nfts(text="bored ape", text_query_mode=TextQueryMode.multi_match),
+    "nfts_empty_text": lambda: nfts(),
+}
+
+
+# publications params whose templated body must equal the dict-built one
+TEMPLATE_CASES = [
+    {"text": "lens protocol"},
+    {"text": "lens", "search_type": SearchType.exact_phrase, "result_type": ResultType.top, "view": ResponseView.card},
+    {"app_id": "lenster orb", "from_users": "stani.lens", "min_collects": 5, "min_mirror": 0, "result_type": ResultType.photo},
+    {"text": "gm", "bio": "builder", "from_date": date(2022, 5, 1), "to_date": date(2022, 5, 31), "fields": "id,stats.*"},
+]
+
+
+def load_snapshots():
+    if not os.path.exists(SNAPSHOTS_PATH):
+        return {}
+    with open(SNAPSHOTS_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def snapshots():
+    snapshots = load_snapshots()
+    yield snapshots
+    if UPDATE_SNAPSHOTS:
+        with open(SNAPSHOTS_PATH, "w") as f:
+            json.dump(snapshots, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_query_body_snapshot(name, snapshots):
+    # a round trip through json compares the body as ES receives it, enums included
+    body = json.loads(json.dumps(CASES[name]()))
+    if UPDATE_SNAPSHOTS:
+        snapshots[name] = body
+    assert body == snapshots.get(name), f"body of '{name}' changed, see the module docstring to update the snapshot"
+
+
+@pytest.mark.parametrize("name", [name for name in CASES if name.startswith(("publications", "profiles"))])
+def test_non_scoring_clauses_in_filter_context(name):
+    body = CASES[name]()
+    for clause in body["query"]["bool"]["must"]:
+        assert not {"term", "terms", "range", "prefix"} & set(clause), f"'{name}' scores a non-scoring clause: {clause}"
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2022, 5, 1, 12, 0, 0)
+
+
+@pytest.mark.parametrize("name, params", [
+    ("trends_day_app", {"app_id": "lenster", "window": TrendsWindow.day}),
+    ("trends_week_per_app", {"window": TrendsWindow.week, "size": 20, "app_ids_size": 5}),
+])
+def test_trends_query_snapshot(name, params, snapshots, monkeypatch):
+    monkeypatch.setattr(lens_service, "datetime", FrozenDatetime)
+    body = json.loads(json.dumps(lens_service.get_trends_query(**params)))
+    if UPDATE_SNAPSHOTS:
+        snapshots[name] = body
+    assert body == snapshots.get(name), f"body of '{name}' changed, see the module docstring to update the snapshot"
+
+
+def test_trends_sample_is_scored_by_recency():
+    function_score = lens_service.get_trends_query(app_id="lenster", window=TrendsWindow.day)["query"]["function_score"]
+    # the window stays a filter, the sampler ranks by the decay alone
+    assert [next(iter(clause)) for clause in function_score["query"]["bool"]["filter"]] == ["range", "term"]
+    assert "must" not in function_score["query"]["bool"]
+    assert function_score["boost_mode"] == "replace"
+    assert function_score["functions"][0]["gauss"]["ingested_at"]["origin"] == "now"
+
+
+@pytest.mark.parametrize("params", TEMPLATE_CASES)
+def test_templated_body_matches_dict_body(params):
+    args = lens_service.get_publications_search_args(**params)
+    body = lens_service.get_search_query(**args, page=2, size=20)
+    request = lens_service.get_templated_search_request("index", **args, page=2, size=20)
+    assert json.loads(request["body"]) == json.loads(json.dumps(body))
+
+
+@pytest.mark.parametrize("suggestion_field", ["handle", "name"])
+def test_single_field_suggestion_uses_the_args_field(suggestion_field):
+    args = {**lens_service.get_profiles_search_args("stani", None, None, None, None, None, None), "suggestion_field": suggestion_field}
+    body = lens_service.get_search_query(**args, suggestion_strategy=SuggestionStrategy.single_field)
+    assert list(body["suggest"]) == [suggestion_field]
+    request = lens_service.get_templated_search_request("index", **args)
+    assert json.loads(request["body"])["suggest"] == body["suggest"]
+
+
+def test_per_endpoint_settings_cover_every_endpoint():
+    # keyed by endpoint, two endpoints configured with the same index name keep their own entries
+    assert set(lens_service.TEXT_QUERY_FIELD_BOOSTS) == set(MultiSearchEndpoint)
+    assert set(lens_service.SUGGESTION_FIELDS) == set(MultiSearchEndpoint)